@@ -46,16 +46,515 @@ The program runs in sensor boost mode by providing the input instruction the val
 Run the BOOST program in sensor boost mode. What are the coordinates of the distress signal?
 '''
 
+import multiprocessing
+import os
+import pickle
 import sys
-from collections import deque
+import time
+from collections import deque, OrderedDict
 from itertools import permutations, cycle
 from operator import setitem
 
 
+class PagedMemory(list):
+    PAGE_SIZE = 1024
+
+    def __init__(self, values=(), page_size=PAGE_SIZE):
+        super().__init__(values)
+        self.__page_size = page_size
+        # Dirty pages are cleared after every checkpoint, changed pages track writes since construction for diff
+        self.__dirty = bytearray(self.__pages_count(len(self)))
+        self.__changed = bytearray(self.__pages_count(len(self)))
+
+    def __reduce__(self):
+        # The default list pickling calls extend before the bitmaps exist, the values go through __init__ instead
+        return self.__class__, (list(self), self.__page_size), (bytes(self.__dirty), bytes(self.__changed))
+
+    def __setstate__(self, state):
+        self.__dirty, self.__changed = bytearray(state[0]), bytearray(state[1])
+
+    @property
+    def page_size(self):
+        return self.__page_size
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        if isinstance(key, slice):
+            start, stop, _ = key.indices(len(self))
+            for page_idx in range(start // self.__page_size, (stop - 1) // self.__page_size + 1):
+                self.__dirty[page_idx] = 1
+                self.__changed[page_idx] = 1
+        else:
+            self.__dirty[key // self.__page_size] = 1
+            self.__changed[key // self.__page_size] = 1
+
+    def extend(self, values):
+        super().extend(values)
+        self.__dirty.extend(bytes(self.__pages_count(len(self)) - len(self.__dirty)))
+        self.__changed.extend(bytes(self.__pages_count(len(self)) - len(self.__changed)))
+
+    def page(self, page_idx):
+        return self[page_idx * self.__page_size:(page_idx + 1) * self.__page_size]
+
+    def dirty_pages(self):
+        page_idx = self.__dirty.find(1)
+        while page_idx >= 0:
+            yield page_idx
+            page_idx = self.__dirty.find(1, page_idx + 1)
+
+    def clear_dirty(self):
+        for page_idx in list(self.dirty_pages()):
+            self.__dirty[page_idx] = 0
+
+    def changed_pages(self):
+        page_idx = self.__changed.find(1)
+        while page_idx >= 0:
+            yield page_idx
+            page_idx = self.__changed.find(1, page_idx + 1)
+
+    def diff(self, other):
+        # Both memories are expected to be built from the same image, only pages written on either side since then
+        # are compared; checkpoints clear the dirty pages but not the changed ones
+        changed_pages = sorted(set(self.changed_pages()) | set(other.changed_pages()))
+        for page_idx in changed_pages:
+            first = page_idx * self.__page_size
+            for offset, (mine, theirs) in enumerate(zip(self.page(page_idx), other.page(page_idx))):
+                if mine != theirs:
+                    yield first + offset, mine, theirs
+
+    def __pages_count(self, length):
+        return (length + self.__page_size - 1) // self.__page_size
+
+
+class Checkpointer:
+
+    def __init__(self, file_path, interval=100000, compact_every=64, sync=False):
+        self.__file_path = file_path
+        self.__interval = interval
+        self.__compact_every = compact_every
+        self.__sync = sync
+        self.__records_since_base = -1
+        self.__saved = 0
+
+    @property
+    def interval(self):
+        return self.__interval
+
+    @property
+    def saved(self):
+        return self.__saved
+
+    def exists(self):
+        return os.path.exists(self.__file_path)
+
+    def save(self, state, memory):
+        # The log starts (and is periodically rewritten) with a full memory image; every later record only
+        # carries the pages written since the previous checkpoint, so the cost follows the write set.
+        self.__saved += 1
+        if self.__records_since_base < 0 or self.__records_since_base >= self.__compact_every:
+            self.__write_base(state, memory)
+            return
+
+        pages = {page: memory.page(page) for page in memory.dirty_pages()}
+        with open(self.__file_path, 'ab') as f:
+            pickle.dump(('delta', state, pages), f, protocol=pickle.HIGHEST_PROTOCOL)
+            self.__flush(f)
+        self.__records_since_base += 1
+
+    def load(self):
+        state, memory = None, None
+        with open(self.__file_path, 'rb') as f:
+            while True:
+                try:
+                    kind, record_state, payload = pickle.load(f)
+                except (EOFError, pickle.UnpicklingError):
+                    # A record cut in half by a crash is dropped, the previous one is still consistent
+                    break
+                if kind == 'base':
+                    memory = PagedMemory(payload)
+                else:
+                    page_size = memory.page_size
+                    for page, content in payload.items():
+                        memory[page * page_size:page * page_size + len(content)] = content
+                state = record_state
+
+        if state is None:
+            raise Exception('Checkpoint {} is empty'.format(self.__file_path))
+        self.__records_since_base = self.__compact_every
+        return state, memory
+
+    def __write_base(self, state, memory):
+        tmp_path = self.__file_path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(('base', state, list(memory)), f, protocol=pickle.HIGHEST_PROTOCOL)
+            self.__flush(f)
+        os.replace(tmp_path, self.__file_path)
+        self.__records_since_base = 0
+
+    def __flush(self, f):
+        f.flush()
+        if self.__sync:
+            os.fsync(f.fileno())
+
+
+class SubroutineMemo:
+
+    def __init__(self, max_entries=100000, min_steps=32, max_trace=1000000, max_depth=10000):
+        self.__entries = OrderedDict()
+        self.__signatures = {}
+        self.__frames = []
+        self.__trace = []
+        self.__max_entries = max_entries
+        self.__min_steps = min_steps
+        self.__max_trace = max_trace
+        self.__max_depth = max_depth
+        self.__hits = 0
+        self.__misses = 0
+
+    @property
+    def hits(self):
+        return self.__hits
+
+    @property
+    def misses(self):
+        return self.__misses
+
+    def is_tracing(self):
+        return len(self.__frames) > 0
+
+    def trace(self, address, is_relative, value):
+        # value None marks a write
+        self.__trace.append((address, is_relative, value))
+        if len(self.__trace) > self.__max_trace:
+            self.__drop_outermost_frame()
+
+    def trace_argument(self, memory, pc, mode, relative_base, is_write):
+        self.trace(pc, False, memory[pc])
+        if mode == 1:
+            if is_write:
+                self.trace(pc, False, None)
+            return
+        address = memory[pc] + relative_base if mode == 2 else memory[pc]
+        self.trace(address, mode == 2, None if is_write else memory[address])
+
+    def mark_impure(self):
+        for frame in self.__frames:
+            frame[4] = False
+
+    def enter(self, pc, relative_base, steps):
+        self.__frames.append([pc, relative_base, len(self.__trace), steps, True])
+        if len(self.__frames) > self.__max_depth:
+            self.__drop_outermost_frame()
+
+    def leave(self, relative_base, memory, next_pc, steps):
+        while self.__frames and self.__frames[-1][1] > relative_base:
+            self.__frames.pop()
+        if not self.__frames or self.__frames[-1][1] != relative_base:
+            return
+
+        pc, base, trace_start, entry_steps, is_pure = self.__frames.pop()
+        if is_pure and steps - entry_steps >= self.__min_steps:
+            self.__store(pc, base, self.__trace[trace_start:], memory, next_pc, steps - entry_steps)
+        if not self.__frames:
+            self.__trace.clear()
+
+    def lookup(self, pc, relative_base, memory):
+        for signature in self.__signatures.get(pc, ()):
+            try:
+                values = tuple(memory[relative_base + key if key >= 0 else -1 - key] for key in signature)
+            except IndexError:
+                continue
+            entry_key = (pc, signature, values)
+            result = self.__entries.get(entry_key)
+            # Absolute accesses have to stay below the frame, otherwise they could alias the relative ones
+            if result is None or result[3] >= relative_base:
+                continue
+
+            self.__entries.move_to_end(entry_key)
+            next_pc, effects, steps, _ = result
+            if self.__frames:
+                for key, value in zip(signature, values):
+                    self.trace(relative_base + key if key >= 0 else -1 - key, key >= 0, value)
+            for offset, value in effects:
+                memory[relative_base + offset] = value
+                if self.__frames:
+                    self.trace(relative_base + offset, True, None)
+            self.__hits += 1
+            return next_pc, steps
+
+        self.__misses += 1
+        return None
+
+    def __store(self, pc, base, trace, memory, next_pc, steps):
+        # Relative accesses are keyed by their offset from the frame base, absolute ones as -1 - address
+        live_ins = {}
+        written = set()
+        max_absolute = -1
+        for address, is_relative, value in trace:
+            if is_relative:
+                if address < base:
+                    return
+                key = address - base
+            else:
+                if address >= base or value is None:
+                    # Absolute write is a side effect outside of the frame
+                    return
+                key = -1 - address
+                max_absolute = max(max_absolute, address)
+
+            if value is None:
+                written.add(key)
+            elif key not in written and key not in live_ins:
+                live_ins[key] = value
+
+        signature = tuple(live_ins.keys())
+        effects = tuple((offset, memory[base + offset]) for offset in written)
+        entry_key = (pc, signature, tuple(live_ins.values()))
+        if entry_key not in self.__entries:
+            signatures = self.__signatures.setdefault(pc, {})
+            signatures[signature] = signatures.get(signature, 0) + 1
+        self.__entries[entry_key] = (next_pc, effects, steps, max_absolute)
+        self.__entries.move_to_end(entry_key)
+
+        while len(self.__entries) > self.__max_entries:
+            (evicted_pc, evicted_signature, _), _ = self.__entries.popitem(last=False)
+            signatures = self.__signatures[evicted_pc]
+            signatures[evicted_signature] -= 1
+            if signatures[evicted_signature] == 0:
+                del signatures[evicted_signature]
+
+    def __drop_outermost_frame(self):
+        self.__frames.pop(0)
+        cut = self.__frames[0][2] if self.__frames else len(self.__trace)
+        del self.__trace[:cut]
+        for frame in self.__frames:
+            frame[2] -= cut
+
+
+class LoopAccelerator:
+    BODY_OPCODES = (1, 2, 7, 8)
+    CONSTANT = None
+
+    def __init__(self, min_iterations=2):
+        self.__bodies = {}
+        self.__min_iterations = min_iterations
+        self.__accelerated = 0
+        self.__skipped_iterations = 0
+
+    @property
+    def accelerated(self):
+        return self.__accelerated
+
+    @property
+    def skipped_iterations(self):
+        return self.__skipped_iterations
+
+    def run(self, target, jump_pc, relative_base, memory):
+        # Called right after a backward jump was taken, memory holds the state at the start of the next iteration
+        key = (target, jump_pc, relative_base)
+        decoded = self.__bodies.get(key)
+        if decoded is None or decoded[0] != memory[target:jump_pc + 3]:
+            decoded = self.__decode(target, jump_pc, relative_base, memory)
+            self.__bodies[key] = decoded
+        _, body, jump, invariant_cells, analysis = decoded
+        if body is None:
+            return None
+
+        # The symbolic evaluation only depends on the code and on the cells the body never writes, a loop rejected
+        # once is not evaluated again on its next backward jump while those cells keep their values
+        invariants = tuple(memory[cell] for cell in invariant_cells)
+        if analysis[0] != invariants:
+            analysis[:] = invariants, self.__analyse(target, body, jump, memory)
+        if analysis[1] is None:
+            return None
+        inductions, accumulators, assigned, flags, difference, test = analysis[1]
+
+        last = self.__last_iteration(test, *self.__linear(difference, inductions, memory))
+        if last is None or last + 1 < self.__min_iterations:
+            return None
+
+        iterations = last + 1
+        writes = {}
+        for cell, delta in inductions.items():
+            writes[cell] = memory[cell] + iterations * delta
+        for cell, expression in accumulators.items():
+            base, slope = self.__linear(expression, inductions, memory)
+            writes[cell] = memory[cell] + iterations * base + slope * iterations * (iterations - 1) // 2
+        for cell, expression in assigned.items():
+            base, slope = self.__linear(expression, inductions, memory)
+            writes[cell] = base + slope * last
+        for cell, (compare_opcode, lhs, rhs) in flags.items():
+            lhs_base, lhs_slope = self.__linear(lhs, inductions, memory)
+            rhs_base, rhs_slope = self.__linear(rhs, inductions, memory)
+            lhs_value, rhs_value = lhs_base + lhs_slope * last, rhs_base + rhs_slope * last
+            writes[cell] = int(lhs_value < rhs_value if compare_opcode == 7 else lhs_value == rhs_value)
+        for cell, val in writes.items():
+            memory[cell] = val
+
+        self.__accelerated += 1
+        self.__skipped_iterations += iterations
+        return jump_pc + 3, iterations * (len(body) + 1)
+
+    def __decode(self, target, jump_pc, relative_base, memory):
+        code = memory[target:jump_pc + 3]
+        operand = lambda mode, word: ('imm', word) if mode == 1 else \
+            ('cell', word + relative_base if mode == 2 else word)
+
+        body = []
+        pc = target
+        while pc < jump_pc:
+            opcode, modes = memory[pc] % 100, memory[pc] // 100
+            if opcode not in LoopAccelerator.BODY_OPCODES:
+                return code, None, None, None, None
+            operands = (operand(modes % 10, memory[pc + 1]),
+                        operand(modes // 10 % 10, memory[pc + 2]),
+                        operand(modes // 100 % 10, memory[pc + 3]))
+            # Writes into the loop code itself would change the loop
+            if operands[2][0] == 'imm' or target <= operands[2][1] < jump_pc + 3:
+                return code, None, None, None, None
+            body.append((opcode, operands))
+            pc += 4
+
+        opcode, modes = memory[pc] % 100, memory[pc] // 100
+        if pc != jump_pc or opcode not in (5, 6):
+            return code, None, None, None, None
+        jump = (opcode, operand(modes % 10, memory[pc + 1]), operand(modes // 10 % 10, memory[pc + 2]))
+
+        written = set(operands[2][1] for _, operands in body)
+        read = [operands[0] for _, operands in body] + [operands[1] for _, operands in body] + list(jump[1:])
+        invariant_cells = tuple(sorted(set(word for kind, word in read if kind == 'cell' and word not in written)))
+        # Last analysed invariant values and the analysis made with them, filled in by run
+        return code, body, jump, invariant_cells, [None, None]
+
+    def __analyse(self, target, body, jump, memory):
+        jump_opcode, condition, jump_target = jump
+        written = set(operands[2][1] for _, operands in body)
+        state = {}
+        value = lambda operand: self.__value(operand, state, written, memory)
+        for opcode, operands in body:
+            lhs, rhs = value(operands[0]), value(operands[1])
+            if isinstance(lhs, tuple) or isinstance(rhs, tuple):
+                return None
+            if opcode == 1:
+                result = self.__add(lhs, rhs)
+            elif opcode == 2:
+                result = self.__multiply(lhs, rhs)
+            else:
+                result = (opcode, lhs, rhs)
+            if result is None:
+                return None
+            state[operands[2][1]] = result
+
+        if value(jump_target) != {LoopAccelerator.CONSTANT: target}:
+            return None
+
+        update = self.__classify(state)
+        if update is None:
+            return None
+        inductions, accumulators, assigned, flags = update
+
+        condition = value(condition)
+        if isinstance(condition, tuple):
+            compare_opcode, lhs, rhs = condition
+            difference = self.__add(lhs, self.__multiply(rhs, {LoopAccelerator.CONSTANT: -1}))
+            if not self.__is_linear(difference, inductions):
+                return None
+            # Kind of test the loop keeps running on, applied to lhs - rhs
+            test = {
+                (5, 7): 'negative', (6, 7): 'not_negative',
+                (5, 8): 'zero', (6, 8): 'not_zero',
+            }[(jump_opcode, compare_opcode)]
+        else:
+            difference = condition
+            if not self.__is_linear(difference, inductions):
+                return None
+            test = 'not_zero' if jump_opcode == 5 else 'zero'
+        return inductions, accumulators, assigned, flags, difference, test
+
+    def __value(self, operand, state, written, memory):
+        kind, word = operand
+        if kind == 'imm':
+            return {LoopAccelerator.CONSTANT: word}
+        if word in state:
+            return state[word]
+        if word in written:
+            return {LoopAccelerator.CONSTANT: 0, word: 1}
+        # Cells the body never writes are loop invariant
+        return {LoopAccelerator.CONSTANT: memory[word]}
+
+    def __classify(self, state):
+        translations, assigned, flags = {}, {}, {}
+        for cell, expression in state.items():
+            if isinstance(expression, tuple):
+                flags[cell] = expression
+            elif expression.get(cell, 0) == 1:
+                translations[cell] = {var: coeff for var, coeff in expression.items() if var != cell}
+            elif expression.get(cell, 0) == 0:
+                assigned[cell] = expression
+            else:
+                return None
+
+        inductions = {cell: delta[LoopAccelerator.CONSTANT] for cell, delta in translations.items() if len(delta) == 1}
+        accumulators = {cell: delta for cell, delta in translations.items() if cell not in inductions}
+        expressions = list(accumulators.values()) + list(assigned.values()) + \
+            [side for _, lhs, rhs in flags.values() for side in (lhs, rhs)]
+        if not all(self.__is_linear(expression, inductions) for expression in expressions):
+            return None
+        return inductions, accumulators, assigned, flags
+
+    def __is_linear(self, expression, inductions):
+        return all(var is LoopAccelerator.CONSTANT or var in inductions for var in expression)
+
+    def __linear(self, expression, inductions, memory):
+        # Value in iteration k is base + slope * k
+        base, slope = 0, 0
+        for var, coeff in expression.items():
+            if var is LoopAccelerator.CONSTANT:
+                base += coeff
+            else:
+                base += coeff * memory[var]
+                slope += coeff * inductions[var]
+        return base, slope
+
+    def __last_iteration(self, test, base, slope):
+        # First iteration k >= 0 on which the loop test fails, None when it never does
+        if test == 'negative':
+            if base >= 0:
+                return 0
+            return None if slope <= 0 else (-base + slope - 1) // slope
+        if test == 'not_negative':
+            if base < 0:
+                return 0
+            return None if slope >= 0 else base // -slope + 1
+        if test == 'zero':
+            if base != 0:
+                return 0
+            return None if slope == 0 else 1
+        if slope == 0:
+            return 0 if base == 0 else None
+        return -base // slope if -base % slope == 0 and -base // slope >= 0 else None
+
+    def __add(self, lhs, rhs):
+        result = dict(lhs)
+        for var, coeff in rhs.items():
+            result[var] = result.get(var, 0) + coeff
+        return {var: coeff for var, coeff in result.items() if coeff != 0 or var is LoopAccelerator.CONSTANT}
+
+    def __multiply(self, lhs, rhs):
+        if len(rhs) > 1:
+            lhs, rhs = rhs, lhs
+        if len(rhs) > 1:
+            return None
+        factor = rhs.get(LoopAccelerator.CONSTANT, 0)
+        return {var: coeff * factor for var, coeff in lhs.items()
+                if coeff * factor != 0 or var is LoopAccelerator.CONSTANT}
+
+
 class Virtual_Machine:
 
     def __init__(self, int_code, program_alarm=False, noun=12, verb=2, debug=False, output_callback=print, input=[],
-                 machine_name=''):
+                 machine_name='', checkpointer=None, checkpoint_state=lambda: None, memo=None,
+                 accelerator=None):
         self.__debug_mode = debug
         self.__machine_name = machine_name
         self.__debug('Debug Mode... ')
@@ -63,7 +562,7 @@ class Virtual_Machine:
         self.__output_callback = output_callback
         self.__pipe_input = input
 
-        self.__int_code = int_code
+        self.__int_code = PagedMemory(int_code)
         self.__int_code.extend([0] * 10000)  # TODO resize
         self.__is_running = True
         self.__pc = 0
@@ -75,17 +574,67 @@ class Virtual_Machine:
             self.__int_code[1] = noun
             self.__int_code[2] = verb
 
+        self.__checkpointer = checkpointer
+        self.__checkpoint_state = checkpoint_state
+        self.__memo = memo
+        self.__accelerator = accelerator
+
+    @classmethod
+    def resume(cls, checkpointer, **kwargs):
+        state, memory = checkpointer.load()
+        vm = cls([], checkpointer=checkpointer, **kwargs)
+        vm.__int_code = memory
+        vm.__pc = state['pc']
+        vm.__last_pc = state['last_pc']
+        vm.__relative_base = state['relative_base']
+        vm.__step_counter = state['step_counter']
+        vm.__is_running = state['is_running']
+        vm.__pipe_input = state['input']
+        vm.__int_code.clear_dirty()
+        return vm, state['extra']
+
     def is_running(self):
         return self.__is_running
 
+    def set_output_callback(self, output_callback):
+        self.__output_callback = output_callback
+
+    @property
+    def step_counter(self):
+        return self.__step_counter
+
     def step(self):
         self.__last_pc = self.__pc
+        start_step = self.__step_counter
 
-        operate_length = self.__operate()
+        if self.__memo is not None and self.__int_code[self.__pc] % 100 == 9:
+            operate_length = self.__memoized_adjust_relative_base()
+        else:
+            operate_length = self.__operate()
 
         self.__pc += operate_length
         self.__step_counter += 1
 
+        # Accelerated loops and memo hits move the counter by more than one step, a checkpoint is due whenever an
+        # interval boundary was crossed
+        if self.__checkpointer is not None and \
+                (start_step // self.__checkpointer.interval != self.__step_counter // self.__checkpointer.interval or
+                 not self.__is_running):
+            self.checkpoint()
+
+    def checkpoint(self):
+        state = {
+            'pc': self.__pc,
+            'last_pc': self.__last_pc,
+            'relative_base': self.__relative_base,
+            'step_counter': self.__step_counter,
+            'is_running': self.__is_running,
+            'input': list(self.__pipe_input),
+            'extra': self.__checkpoint_state(),
+        }
+        self.__checkpointer.save(state, self.__int_code)
+        self.__int_code.clear_dirty()
+
     def first_position(self):
         first_pos = 0
         return self.__int_code[first_pos]
@@ -102,6 +651,8 @@ class Virtual_Machine:
 
     def __operate(self):
         self.__arg_mode_stack.clear()
+        if self.__memo is not None and self.__memo.is_tracing():
+            self.__memo.trace(self.__pc, False, self.__int_code[self.__pc])
 
         modes = self.__int_code[self.__pc] // 100
         for arg in range(3):
@@ -150,6 +701,8 @@ class Virtual_Machine:
             val = int(input())
 
         self.__debug('ReadVal={} Buffer={}'.format(val, self.__pipe_input))
+        if self.__memo is not None:
+            self.__memo.mark_impure()
 
         self.__write_arg(val)
         return 1
@@ -157,6 +710,8 @@ class Virtual_Machine:
     def __print(self):
         arg1 = self.__read_arg()
         self.__output_callback(arg1, end='')
+        if self.__memo is not None:
+            self.__memo.mark_impure()
         return 1
 
     def __jmp_if_true(self):
@@ -164,7 +719,7 @@ class Virtual_Machine:
         jump_pc = self.__read_arg()
         if arg1 != 0:
             self.__pc = jump_pc
-            return 0
+            return self.__accelerate_loop()
         return 1
 
     def __jmp_if_false(self):
@@ -172,7 +727,7 @@ class Virtual_Machine:
         jump_pc = self.__read_arg()
         if arg1 == 0:
             self.__pc = jump_pc
-            return 0
+            return self.__accelerate_loop()
         return 1
 
     def __less_than(self):
@@ -203,28 +758,73 @@ class Virtual_Machine:
         self.__is_running = False
         return 1
 
+    def __accelerate_loop(self):
+        # Backward jump just taken, try to run the remaining iterations in closed form
+        if self.__accelerator is None or self.__pc > self.__last_pc:
+            return 0
+
+        accelerated = self.__accelerator.run(self.__pc, self.__last_pc, self.__relative_base, self.__int_code)
+        if accelerated is not None:
+            if self.__memo is not None:
+                self.__memo.mark_impure()
+            self.__pc, steps = accelerated
+            self.__step_counter += steps
+        return 0
+
+    def __memoized_adjust_relative_base(self):
+        # Frame is opened by a positive relative base adjustment and closed by the one restoring the base;
+        # a frame seen before with the same live-in memory is skipped by replaying its writes
+        pc = self.__pc
+        delta = {
+            0: lambda: self.__int_code[self.__int_code[pc + 1]],
+            1: lambda: self.__int_code[pc + 1],
+            2: lambda: self.__int_code[self.__int_code[pc + 1] + self.__relative_base]
+        }[self.__int_code[pc] // 100 % 10]()
+
+        if delta > 0:
+            hit = self.__memo.lookup(pc, self.__relative_base, self.__int_code)
+            if hit is not None:
+                self.__pc, steps = hit
+                self.__step_counter += steps - 1
+                return 0
+            self.__memo.enter(pc, self.__relative_base, self.__step_counter)
+
+        operate_length = self.__operate()
+        if delta < 0:
+            self.__memo.leave(self.__relative_base, self.__int_code, self.__pc + operate_length,
+                              self.__step_counter + 1)
+        return operate_length
+
     # Helpers
     def __read_arg(self):
         self.__pc += 1
         if self.__pc >= len(self.__int_code):
             raise Exception('Segmentation fault')
 
+        mode = self.__arg_mode_stack.pop()
+        if self.__memo is not None and self.__memo.is_tracing():
+            self.__memo.trace_argument(self.__int_code, self.__pc, mode, self.__relative_base, False)
+
         return {
             0: lambda: self.__int_code[self.__int_code[self.__pc]],
             1: lambda: self.__int_code[self.__pc],
             2: lambda: self.__int_code[self.__int_code[self.__pc] + self.__relative_base]
-        }[self.__arg_mode_stack.pop()]()
+        }[mode]()
 
     def __write_arg(self, val):
         self.__pc += 1
         if self.__pc >= len(self.__int_code):
             raise Exception('Segmentation fault')
 
+        mode = self.__arg_mode_stack.pop()
+        if self.__memo is not None and self.__memo.is_tracing():
+            self.__memo.trace_argument(self.__int_code, self.__pc, mode, self.__relative_base, True)
+
         {
             0: lambda: setitem(self.__int_code, self.__int_code[self.__pc], val),
             1: lambda: setitem(self.__int_code, self.__pc, val),
             2: lambda: setitem(self.__int_code, self.__int_code[self.__pc] + self.__relative_base, val),
-        }[self.__arg_mode_stack.pop()]()
+        }[mode]()
 
     def __debug(self, message):
         if self.__debug_mode:
@@ -278,13 +878,116 @@ class SignalQueue:
         return self.__queue
 
 
+def intcode_worker(programs, requests, results):
+    while True:
+        job = requests.get()
+        if job is None:
+            break
+
+        job_id, program_name, inputs = job
+        outputs = []
+        started = time.perf_counter()
+        try:
+            # VM pops its input from the end of the list
+            vm = Virtual_Machine(list(programs[program_name]),
+                                 output_callback=lambda message, **args: outputs.append(message),
+                                 input=list(reversed(inputs)), machine_name='Worker_{}'.format(os.getpid()))
+            while vm.is_running():
+                vm.step()
+            error = None
+            steps = vm.step_counter
+        except Exception as e:
+            error = '{}: {}'.format(type(e).__name__, e)
+            steps = -1
+        results.put((job_id, outputs, {
+            'steps': steps,
+            'elapsed': time.perf_counter() - started,
+            'worker': os.getpid(),
+            'error': error,
+        }))
+
+
+class IntcodeWorkerPool:
+
+    def __init__(self, programs, workers=None):
+        self.__requests = multiprocessing.Queue()
+        self.__results = multiprocessing.Queue()
+        self.__next_job_id = 0
+        self.__pending = 0
+        self.__workers = [
+            multiprocessing.Process(target=intcode_worker, args=(programs, self.__requests, self.__results),
+                                    daemon=True)
+            for _ in range(workers or os.cpu_count())
+        ]
+        [worker.start() for worker in self.__workers]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def submit(self, program_name, inputs=()):
+        job_id = self.__next_job_id
+        self.__next_job_id += 1
+        self.__pending += 1
+        self.__requests.put((job_id, program_name, list(inputs)))
+        return job_id
+
+    def results(self):
+        while self.__pending > 0:
+            result = self.__results.get()
+            self.__pending -= 1
+            yield result
+
+    def run(self, jobs):
+        job_ids = [self.submit(program_name, inputs) for program_name, inputs in jobs]
+        finished = {job_id: (outputs, stats) for job_id, outputs, stats in self.results()}
+        return [finished[job_id] for job_id in job_ids]
+
+    def close(self):
+        [self.__requests.put(None) for _ in self.__workers]
+        [worker.join() for worker in self.__workers]
+
+
+def pool_main(argv):
+    # 09_II.py --pool <program> <input> [<input> ...], each input is a comma separated job input
+    with IntcodeWorkerPool({'program': parse_file(argv[2])}) as pool:
+        [pool.submit('program', map(int, inputs.split(','))) for inputs in argv[3:]]
+        for job_id, outputs, stats in pool.results():
+            print('Job {}: {} {}'.format(job_id, outputs, stats))
+
+
 def main(argv):
+    if argv[1] == '--pool':
+        return pool_main(argv)
+
+    memo = SubroutineMemo() if '--memo' in argv else None
+    accelerator = LoopAccelerator() if '--accelerate' in argv else None
+    argv = [arg for arg in argv if arg not in ('--memo', '--accelerate')]
+
     sq = SignalQueue([], 'SQ')
-    vm = Virtual_Machine(parse_file(argv[1]), debug=True, output_callback=sq, machine_name='MySuperiorMachine')
+    checkpointer = Checkpointer(argv[2]) if len(argv) > 2 else None
+    if checkpointer is not None and checkpointer.exists():
+        vm, sq = Virtual_Machine.resume(checkpointer, debug=True, machine_name='MySuperiorMachine',
+                                        checkpoint_state=lambda: sq, memo=memo, accelerator=accelerator)
+        # Output queue comes back from the checkpoint, class level max has to be rebuilt from it
+        vm.set_output_callback(sq)
+        SignalQueue.g_max = max(sq.get_queue(), default=SignalQueue.g_max)
+    else:
+        vm = Virtual_Machine(parse_file(argv[1]), debug=True, output_callback=sq, machine_name='MySuperiorMachine',
+                             checkpointer=checkpointer, checkpoint_state=lambda: sq, memo=memo,
+                             accelerator=accelerator)
     while vm.is_running():
         vm.step()
 
     print('Max_output={}'.format(SignalQueue.g_max))
+    if memo is not None:
+        print('Memo hits={} misses={}'.format(memo.hits, memo.misses))
+    if accelerator is not None:
+        print('Accelerated loops={} iterations={}'.format(accelerator.accelerated, accelerator.skipped_iterations))
+    if checkpointer is not None:
+        print('Checkpoints saved={} steps={}'.format(checkpointer.saved, vm.step_counter))
 
 
 if __name__ == "__main__":
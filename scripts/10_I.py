@@ -99,85 +99,47 @@ Find the best location for a new monitoring station. How many other asteroids ca
 
 import sys
 import math
+import numpy as np
 from copy import deepcopy
-from itertools import islice, cycle
 from operator import setitem
 
 
-def ray_2pi_trace_asteroids(asteroid_map, x_pos, y_pos):
-    if asteroid_map[y_pos][x_pos] != '#':
-        return -1, -1, -1, -1
-        # raise Exception('Probe might be put only on asteroid')
-
-    x_len = len(asteroid_map[0])
-    y_len = len(asteroid_map)
-
-    is_in_range = lambda cur_x, cur_y: cur_x >= 0 and cur_y >= 0 and cur_x < x_len and cur_y < y_len
-    is_asteroid = lambda field: field != '.'
-
-    elements_2_pi = []
-    asteroid_counter = 0
-    # print('X|------------------------------------------')
-    visited_points = {}
-    for x_wall in range(x_pos + 1, x_len):
-        y_vec = islice(cycle(range(y_len)), y_pos, y_pos + y_len)
-        for vec in zip([x_wall] * x_len, y_vec):
-            # # print('vec', vec)
-            cur_x, cur_y = vec
-            if (cur_x, cur_y) in visited_points.keys():
-                continue
-            is_found = False
-            while is_in_range(cur_x, cur_y):
-                if is_asteroid(asteroid_map[cur_y][cur_x]) and not is_found:
-                    is_found = True
-                    # print('{};{}:{}'.format(cur_x, cur_y, asteroid_map[cur_y][cur_x], end=' '))
-                    asteroid_counter += 1
-                    elements_2_pi.append((cur_x, cur_y))
-                visited_points[(cur_x, cur_y)] = True
-
-                cur_x += vec[0] - x_pos
-                cur_y += vec[1] - y_pos
-    # print('|X------------------------------------------')
-    visited_points = {}
-    for x_wall in reversed(range(x_pos)):
-        y_vec = islice(cycle(range(y_len)), y_pos, y_pos + y_len)
-        for vec in zip([x_wall] * x_len, y_vec):
-            cur_x, cur_y = vec
-            if (cur_x, cur_y) in visited_points.keys():
-                continue
-            is_found = False
-            while is_in_range(cur_x, cur_y):
-                if is_asteroid(asteroid_map[cur_y][cur_x]) and not is_found:
-                    is_found = True
-                    # print('{};{}:{}'.format(cur_x, cur_y, asteroid_map[cur_y][cur_x], end=' '))
-                    asteroid_counter += 1
-                    elements_2_pi.append((cur_x, cur_y))
-                visited_points[(cur_x, cur_y)] = True
-
-                cur_x += vec[0] - x_pos
-                cur_y += vec[1] - y_pos
-
-    # print('^X^-----------------------------------------')
-    cur_x, cur_y = x_pos, y_pos + 1
-    while is_in_range(cur_x, cur_y):
-        if is_asteroid(asteroid_map[cur_y][cur_x]):
-            # print('{};{}:{}'.format(cur_x, cur_y, asteroid_map[cur_y][cur_x], end=' '))
-            asteroid_counter += 1
-            elements_2_pi.append((cur_x, cur_y))
-            break
-        cur_y += 1
-
-    # print('vXv-----------------------------------------')
-    cur_x, cur_y = x_pos, y_pos - 1
-    while is_in_range(cur_x, cur_y):
-        if is_asteroid(asteroid_map[cur_y][cur_x]):
-            # print('{};{}:{}'.format(cur_x, cur_y, asteroid_map[cur_y][cur_x], end=' '))
-            asteroid_counter += 1
-            elements_2_pi.append((cur_x, cur_y))
-            break
-        cur_y -= 1
-
-    return x_pos, y_pos, asteroid_counter, elements_2_pi
+def asteroid_coords(asteroid_map):
+    ys, xs = np.nonzero(np.array(asteroid_map) == '#')
+    return np.stack([xs, ys], axis=1).astype(np.int64)
+
+
+def direction_keys(coords, stations):
+    # Offsets from every station to every asteroid reduced by their GCD, so asteroids on one line of sight share a
+    # key; the station itself gets the (0, 0) direction. Returns the keys and the GCDs (steps along the direction)
+    dx = coords[None, :, 0] - coords[stations, None, 0]
+    dy = coords[None, :, 1] - coords[stations, None, 1]
+    steps = np.gcd(dx, dy)
+    np.maximum(steps, 1, out=steps)
+    span = int(np.abs(coords).max(initial=0)) + 1
+    return (dx // steps + span) * (2 * span + 1) + (dy // steps + span), steps
+
+
+def visibility_counts(coords, block_size=1 << 22):
+    # Number of distinct directions from every asteroid, stations are processed in blocks of at most block_size keys
+    counts = np.empty(len(coords), dtype=np.int64)
+    block = max(1, block_size // max(1, len(coords)))
+    for first in range(0, len(coords), block):
+        keys, _ = direction_keys(coords, np.arange(first, min(first + block, len(coords))))
+        keys.sort(axis=1)
+        counts[first:first + block] = (keys[:, 1:] != keys[:, :-1]).sum(axis=1)
+    return counts
+
+
+def visible_asteroids(coords, station):
+    # Nearest asteroid in every direction seen from the station
+    keys, steps = direction_keys(coords, np.array([station]))
+    keys, steps = keys[0], steps[0]
+    others = np.flatnonzero(np.arange(len(coords)) != station)
+    order = others[np.lexsort((steps[others], keys[others]))]
+    is_first = np.ones(len(order), dtype=bool)
+    is_first[1:] = keys[order][1:] != keys[order][:-1]
+    return list(map(tuple, coords[order[is_first]].tolist()))
 
 
 def normalize_vector(x_pos, y_pos, vec):
@@ -220,7 +182,8 @@ def vaporize(asteroid_map, x_pos, y_pos, number, initial_buffer=[]):
             if destroyed == number:
                 print('{}th pos {}, answer={}'.format(number, vec, vec[0] * 100 + vec[1]))
 
-        _, _, _, initial_buffer = ray_2pi_trace_asteroids(asteroid_map, x_pos, y_pos)
+        coords = asteroid_coords(asteroid_map)
+        initial_buffer = visible_asteroids(coords, int(np.flatnonzero((coords == (x_pos, y_pos)).all(axis=1))[0]))
 
 
 def parse_file(file_path: str):
@@ -234,16 +197,12 @@ def parse_file(file_path: str):
 
 def main(argv):
     asteroid_map = parse_file(argv[1])
-    x_best, y_best, max = -1, -1, -1
-    elements_2_pi = []
-    for y in range(len(asteroid_map)):
-        for x in range(len(asteroid_map[0])):
-            x_cur, y_cur, count_cur, cur_elements_2_pi = ray_2pi_trace_asteroids(asteroid_map, x, y)
-            if max < count_cur:
-                max = count_cur
-                x_best = x_cur
-                y_best = y_cur
-                elements_2_pi = cur_elements_2_pi
+    coords = asteroid_coords(asteroid_map)
+    counts = visibility_counts(coords)
+    best = int(counts.argmax())
+    x_best, y_best = coords[best].tolist()
+    max = int(counts[best])
+    elements_2_pi = visible_asteroids(coords, best)
 
     # vaporize(deepcopy(asteroid_map), x_best, y_best, 200, elements_2_pi)
     [vaporize(deepcopy(asteroid_map), x_best, y_best, 347, elements_2_pi) for num in range(30)]
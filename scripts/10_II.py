@@ -99,84 +99,79 @@ Find the best location for a new monitoring station. How many other asteroids ca
 
 import sys
 import math
+import multiprocessing
+import numpy as np
 from copy import deepcopy
-from itertools import islice, cycle
-
-
-def ray_2pi_trace_asteroids(asteroid_map, x_pos, y_pos):
-    if asteroid_map[y_pos][x_pos] != '#':
-        return -1, -1, -1, -1
-
-    x_len = len(asteroid_map[0])
-    y_len = len(asteroid_map)
-
-    is_in_range = lambda cur_x, cur_y: 0 <= cur_x < x_len and 0 <= cur_y < y_len
-    is_asteroid = lambda field: field != '.'
-
-    elements_2_pi = []
-    asteroid_counter = 0
-    # print('X|------------------------------------------')
-    visited_points = {}
-    for x_wall in range(x_pos + 1, x_len):
-        y_vec = islice(cycle(range(y_len)), y_pos, y_pos + y_len)
-        for vec in zip([x_wall] * x_len, y_vec):
-            # # print('vec', vec)
-            cur_x, cur_y = vec
-            if (cur_x, cur_y) in visited_points.keys():
-                continue
-            is_found = False
-            while is_in_range(cur_x, cur_y):
-                if is_asteroid(asteroid_map[cur_y][cur_x]) and not is_found:
-                    is_found = True
-                    # print('{};{}:{}'.format(cur_x, cur_y, asteroid_map[cur_y][cur_x], end=' '))
-                    asteroid_counter += 1
-                    elements_2_pi.append((cur_x, cur_y))
-                visited_points[(cur_x, cur_y)] = True
-
-                cur_x += vec[0] - x_pos
-                cur_y += vec[1] - y_pos
-
-    # print('|X------------------------------------------')
-    visited_points = {}
-    for x_wall in reversed(range(x_pos)):
-        y_vec = islice(cycle(range(y_len)), y_pos, y_pos + y_len)
-        for vec in zip([x_wall] * x_len, y_vec):
-            cur_x, cur_y = vec
-            if (cur_x, cur_y) in visited_points.keys():
-                continue
-            is_found = False
-            while is_in_range(cur_x, cur_y):
-                if is_asteroid(asteroid_map[cur_y][cur_x]) and not is_found:
-                    is_found = True
-                    # print('{};{}:{}'.format(cur_x, cur_y, asteroid_map[cur_y][cur_x], end=' '))
-                    asteroid_counter += 1
-                    elements_2_pi.append((cur_x, cur_y))
-                visited_points[(cur_x, cur_y)] = True
-
-                cur_x += vec[0] - x_pos
-                cur_y += vec[1] - y_pos
-
-    # print('^X^-----------------------------------------')
-    cur_x, cur_y = x_pos, y_pos + 1
-    while is_in_range(cur_x, cur_y):
-        if is_asteroid(asteroid_map[cur_y][cur_x]):
-            # print('{};{}:{}'.format(cur_x, cur_y, asteroid_map[cur_y][cur_x], end=' '))
-            asteroid_counter += 1
-            elements_2_pi.append((cur_x, cur_y))
-            break
-        cur_y += 1
-
-    # print('vXv-----------------------------------------')
-    cur_x, cur_y = x_pos, y_pos - 1
-    while is_in_range(cur_x, cur_y):
-        if is_asteroid(asteroid_map[cur_y][cur_x]):
-            # print('{};{}:{}'.format(cur_x, cur_y, asteroid_map[cur_y][cur_x], end=' '))
-            asteroid_counter += 1
-            elements_2_pi.append((cur_x, cur_y))
-            break
-        cur_y -= 1
-
-    return x_pos, y_pos, asteroid_counter, elements_2_pi
+
+
+def asteroid_coords(asteroid_map):
+    ys, xs = np.nonzero(np.array(asteroid_map) == '#')
+    return np.stack([xs, ys], axis=1).astype(np.int64)
+
+
+def direction_keys(coords, stations):
+    # Offsets from every station to every asteroid reduced by their GCD, so asteroids on one line of sight share a
+    # key; the station itself gets the (0, 0) direction. Returns the keys and the GCDs (steps along the direction)
+    dx = coords[None, :, 0] - coords[stations, None, 0]
+    dy = coords[None, :, 1] - coords[stations, None, 1]
+    steps = np.gcd(dx, dy)
+    np.maximum(steps, 1, out=steps)
+    span = int(np.abs(coords).max(initial=0)) + 1
+    return (dx // steps + span) * (2 * span + 1) + (dy // steps + span), steps
+
+
+def visibility_counts(coords, first_station=0, last_station=None, block_size=1 << 22):
+    # Number of distinct directions from the asteroids first_station..last_station - 1 (all by default), stations
+    # are processed in blocks of at most block_size keys
+    last_station = len(coords) if last_station is None else last_station
+    counts = np.empty(last_station - first_station, dtype=np.int64)
+    block = max(1, block_size // max(1, len(coords)))
+    for first in range(first_station, last_station, block):
+        keys, _ = direction_keys(coords, np.arange(first, min(first + block, last_station)))
+        keys.sort(axis=1)
+        counts[first - first_station:first - first_station + block] = (keys[:, 1:] != keys[:, :-1]).sum(axis=1)
+    return counts
+
+
+station_coords = None
+
+
+def share_station_map(coords):
+    # Pool initializer; with the fork start method the array is inherited by the workers instead of being copied
+    global station_coords
+    station_coords = coords
+    station_coords.flags.writeable = False
+
+
+def count_station_range(station_range):
+    first_station, last_station = station_range
+    return first_station, visibility_counts(station_coords, first_station, last_station)
+
+
+def top_stations(coords, k=1, workers=None, chunks_per_worker=4):
+    # Candidate stations are sharded into ranges over a process pool, returns the k best as (x, y, visible) with
+    # ties kept in map order
+    workers = workers or multiprocessing.cpu_count()
+    chunk = max(1, -(-len(coords) // (workers * chunks_per_worker)))
+    counts = np.empty(len(coords), dtype=np.int64)
+    with multiprocessing.Pool(workers, initializer=share_station_map, initargs=(coords,)) as pool:
+        ranges = [(first, min(first + chunk, len(coords))) for first in range(0, len(coords), chunk)]
+        for first_station, range_counts in pool.imap_unordered(count_station_range, ranges):
+            counts[first_station:first_station + len(range_counts)] = range_counts
+
+    best = np.argsort(-counts, kind='stable')[:k]
+    return [(x, y, visible) for (x, y), visible in zip(coords[best].tolist(), counts[best].tolist())]
+
+
+def visible_asteroids(coords, station):
+    # Nearest asteroid in every direction seen from the station
+    keys, steps = direction_keys(coords, np.array([station]))
+    keys, steps = keys[0], steps[0]
+    others = np.flatnonzero(np.arange(len(coords)) != station)
+    order = others[np.lexsort((steps[others], keys[others]))]
+    is_first = np.ones(len(order), dtype=bool)
+    is_first[1:] = keys[order][1:] != keys[order][:-1]
+    return list(map(tuple, coords[order[is_first]].tolist()))
 
 
 def normalize_vector(x_pos, y_pos, vec):
@@ -220,7 +215,8 @@ def vaporize(asteroid_map, x_pos, y_pos, number, initial_buffer=[]):
             if destroyed == number:
                 print('{}th pos {}, answer={}'.format(number, vec, vec[0] * 100 + vec[1]))
 
-        _, _, _, initial_buffer = ray_2pi_trace_asteroids(asteroid_map, x_pos, y_pos)
+        coords = asteroid_coords(asteroid_map)
+        initial_buffer = visible_asteroids(coords, int(np.flatnonzero((coords == (x_pos, y_pos)).all(axis=1))[0]))
 
 
 def parse_file(file_path: str):
@@ -234,16 +230,13 @@ def parse_file(file_path: str):
 
 def main(argv):
     asteroid_map = parse_file(argv[1])
-    x_best, y_best, max = -1, -1, -1
-    elements_2_pi = []
-    for y in range(len(asteroid_map)):
-        for x in range(len(asteroid_map[0])):
-            x_cur, y_cur, count_cur, cur_elements_2_pi = ray_2pi_trace_asteroids(asteroid_map, x, y)
-            if max < count_cur:
-                max = count_cur
-                x_best = x_cur
-                y_best = y_cur
-                elements_2_pi = cur_elements_2_pi
+    coords = asteroid_coords(asteroid_map)
+    stations = top_stations(coords, int(argv[argv.index('--top') + 1]) if '--top' in argv else 1)
+    for x, y, visible in stations[1:]:
+        print('Station {};{} sees {}'.format(x, y, visible))
+    x_best, y_best, max = stations[0]
+    best = int(np.flatnonzero((coords == (x_best, y_best)).all(axis=1))[0])
+    elements_2_pi = visible_asteroids(coords, best)
 
     vaporize(deepcopy(asteroid_map), x_best, y_best, 200, elements_2_pi)
     # [vaporize(deepcopy(asteroid_map), x_best, y_best, num, elements_2_pi) for num in range(30)]
@@ -280,67 +280,135 @@ class SignalQueue:
             print('{}:{}'.format(self.__name, message))
 
 
+class PanelGrid:
+    CHUNK_BITS = 6
+    CHUNK_SIZE = 1 << CHUNK_BITS
+    CHUNK_MASK = CHUNK_SIZE - 1
+
+    def __init__(self):
+        # Panels live in square bytearray chunks created on demand, a cell holds its color + 1 and 0 when unpainted
+        self.__chunks = {}
+        self.__painted_counter = 0
+        self.__bounds = None
+
+    def __len__(self):
+        return self.__painted_counter
+
+    def __contains__(self, pos):
+        return self.__cell(pos) != 0
+
+    def __getitem__(self, pos):
+        value = self.__cell(pos)
+        if value == 0:
+            raise KeyError(pos)
+        return value - 1
+
+    def __setitem__(self, pos, color):
+        x, y = pos
+        key = (x >> PanelGrid.CHUNK_BITS, y >> PanelGrid.CHUNK_BITS)
+        chunk = self.__chunks.get(key)
+        if chunk is None:
+            chunk = self.__chunks[key] = bytearray(PanelGrid.CHUNK_SIZE * PanelGrid.CHUNK_SIZE)
+        offset = ((y & PanelGrid.CHUNK_MASK) << PanelGrid.CHUNK_BITS) | (x & PanelGrid.CHUNK_MASK)
+        if chunk[offset] == 0:
+            self.__painted_counter += 1
+            if self.__bounds is None:
+                self.__bounds = (x, x, y, y)
+            else:
+                min_x, max_x, min_y, max_y = self.__bounds
+                self.__bounds = (min(min_x, x), max(max_x, x), min(min_y, y), max(max_y, y))
+        chunk[offset] = color + 1
+
+    def get(self, pos, default=None):
+        value = self.__cell(pos)
+        return default if value == 0 else value - 1
+
+    @property
+    def bounds(self):
+        # (min_x, max_x, min_y, max_y) of the painted panels
+        return self.__bounds
+
+    def __cell(self, pos):
+        x, y = pos
+        chunk = self.__chunks.get((x >> PanelGrid.CHUNK_BITS, y >> PanelGrid.CHUNK_BITS))
+        if chunk is None:
+            return 0
+        return chunk[((y & PanelGrid.CHUNK_MASK) << PanelGrid.CHUNK_BITS) | (x & PanelGrid.CHUNK_MASK)]
+
+
 class RouterTracker:
     BLACK = 0
     WHITE = 0
     TURN_RIGHT = 1
     TURN_LEFT = 0
 
-    def __init__(self):
+    # Headings are indices into the vectors, a turn adds +1 (right) or -1 (left) modulo 4
+    DIRECTIONS = ((0, 1), (1, 0), (0, -1), (-1, 0))
+    DIRECTION_LABELS = 'URDL'
+    TURNS = {TURN_RIGHT: 1, TURN_LEFT: -1}
+
+    def __init__(self, trace_sink=None):
         self.__is_even_step = False
         self.__current_pos = (0, 0)
         self.__panel_counter = 0
         self.__direction = 0
-        self.__visited_pos = {}
+        self.__panels = PanelGrid()
         self.__before_painting = RouterTracker.BLACK
         self.__after_painting = -1
         self.__idx = 1
+        self.__trace_sink = trace_sink
+        self.__events = {'reads': 0, 'paints': 0, 'moves': 0}
 
     def __call__(self, operation=None, **args):
         if operation is None:
-            cur_color = RouterTracker.BLACK if self.__current_pos not in self.__visited_pos.keys() else self.__visited_pos[self.__current_pos]
-            print('{}'.format(cur_color), end=' ')
+            cur_color = self.__panels.get(self.__current_pos, RouterTracker.BLACK)
+            self.__events['reads'] += 1
+            if self.__trace_sink is not None:
+                self.__trace_sink.write('R {} {}\n'.format(self.__current_pos, cur_color))
             return cur_color
 
-        print('{}'.format(operation), end=' ')
         self.__move_operation(operation) if self.__is_even_step else self.__painting_operation(operation)
         self.__is_even_step = not self.__is_even_step
 
+    @property
+    def events(self):
+        return dict(self.__events)
+
     @property
     def panel_counter(self):
-        return len(self.__visited_pos.keys())
+        return len(self.__panels)
 
     def __painting_operation(self, color):
-        self.__visited_pos[self.__current_pos] = color
+        self.__panels[self.__current_pos] = color
+        self.__events['paints'] += 1
+        if self.__trace_sink is not None:
+            self.__trace_sink.write('P {} {}\n'.format(self.__current_pos, color))
 
     def __move_operation(self, direction):
-        if direction is RouterTracker.TURN_RIGHT:
-            self.__direction += 1
-        elif direction is RouterTracker.TURN_LEFT:
-            self.__direction += -1
-        else:
+        turn = RouterTracker.TURNS.get(direction)
+        if turn is None:
             raise Exception('Not supported operation Op({})'.format(direction))
-        self.__direction %= 4
-        {
-            0: lambda: self.__move((0, 1)),
-            1: lambda: self.__move((1, 0)),
-            2: lambda: self.__move((0, -1)),
-            3: lambda: self.__move((-1, 0))
-        }[self.__direction]()
-
-    def __move(self, vec):
-        direction = {
-            (0, 1): 'U',
-            (1, 0): 'R',
-            (0, -1): 'D',
-            (-1, 0): 'L'
-        }[vec]
-        print('{}:{}:{}'.format(self.__current_pos, self.__direction, direction))
-        self.__current_pos = (self.__current_pos[0] + vec[0], self.__current_pos[1] + vec[1])
+        self.__direction = (self.__direction + turn) % 4
+        self.__move()
+
+    def __move(self):
+        self.__events['moves'] += 1
+        if self.__trace_sink is not None:
+            self.__trace_sink.write('M {} {} {}\n'.format(self.__current_pos, self.__direction,
+                                                           RouterTracker.DIRECTION_LABELS[self.__direction]))
+        dx, dy = RouterTracker.DIRECTIONS[self.__direction]
+        self.__current_pos = (self.__current_pos[0] + dx, self.__current_pos[1] + dy)
 
 
 def main(argv):
-    rt = RouterTracker()
+    trace_sink = None
+    if '--trace' in argv:
+        # The move log goes through a large write buffer, nothing is printed per instruction
+        trace_idx = argv.index('--trace')
+        trace_sink = open(argv[trace_idx + 1], 'w', buffering=1 << 20)
+        argv = argv[:trace_idx] + argv[trace_idx + 2:]
+
+    rt = RouterTracker(trace_sink)
     vm = VirtualMachine(parse_file(argv[1]), debug=False,
                         output_callback=rt, input_callback=rt,
                         machine_name='Robot')
@@ -349,6 +417,9 @@ def main(argv):
     while vm.is_running():
         vm.step()
 
+    if trace_sink is not None:
+        trace_sink.close()
+    print('Events: {}'.format(rt.events))
     print('Max_output={}'.format(rt.panel_counter))
 
 
@@ -59,6 +59,10 @@ Build a new emergency hull painting robot and run the Intcode program on it. How
 '''
 
 import sys
+import multiprocessing
+import struct
+import zlib
+import numpy as np
 from collections import deque
 from itertools import permutations, cycle
 from operator import setitem
@@ -280,102 +284,342 @@ class SignalQueue:
             print('{}:{}'.format(self.__name, message))
 
 
+class PanelGrid:
+    CHUNK_BITS = 6
+    CHUNK_SIZE = 1 << CHUNK_BITS
+    CHUNK_MASK = CHUNK_SIZE - 1
+
+    def __init__(self):
+        # Panels live in square bytearray chunks created on demand, a cell holds its color + 1 and 0 when unpainted
+        self.__chunks = {}
+        self.__painted_counter = 0
+        self.__bounds = None
+
+    def __len__(self):
+        return self.__painted_counter
+
+    def __contains__(self, pos):
+        return self.__cell(pos) != 0
+
+    def __getitem__(self, pos):
+        value = self.__cell(pos)
+        if value == 0:
+            raise KeyError(pos)
+        return value - 1
+
+    def __setitem__(self, pos, color):
+        x, y = pos
+        key = (x >> PanelGrid.CHUNK_BITS, y >> PanelGrid.CHUNK_BITS)
+        chunk = self.__chunks.get(key)
+        if chunk is None:
+            chunk = self.__chunks[key] = bytearray(PanelGrid.CHUNK_SIZE * PanelGrid.CHUNK_SIZE)
+        offset = ((y & PanelGrid.CHUNK_MASK) << PanelGrid.CHUNK_BITS) | (x & PanelGrid.CHUNK_MASK)
+        if chunk[offset] == 0:
+            self.__painted_counter += 1
+            if self.__bounds is None:
+                self.__bounds = (x, x, y, y)
+            else:
+                min_x, max_x, min_y, max_y = self.__bounds
+                self.__bounds = (min(min_x, x), max(max_x, x), min(min_y, y), max(max_y, y))
+        chunk[offset] = color + 1
+
+    def get(self, pos, default=None):
+        value = self.__cell(pos)
+        return default if value == 0 else value - 1
+
+    def paint_many(self, xs, ys, colors):
+        # Later paints of the same panel win, so only the last paint of every panel is written, chunk by chunk
+        if len(xs) == 0:
+            return
+        positions, last_idx = np.unique(np.stack([xs, ys], axis=1)[::-1], axis=0, return_index=True)
+        values = np.asarray(colors)[::-1][last_idx] + 1
+        xs, ys = positions[:, 0], positions[:, 1]
+
+        chunk_keys, chunk_idx = np.unique(np.stack([xs >> PanelGrid.CHUNK_BITS, ys >> PanelGrid.CHUNK_BITS], axis=1),
+                                          axis=0, return_inverse=True)
+        chunk_idx = chunk_idx.reshape(-1)
+        offsets = ((ys & PanelGrid.CHUNK_MASK) << PanelGrid.CHUNK_BITS) | (xs & PanelGrid.CHUNK_MASK)
+        order = np.argsort(chunk_idx, kind='stable')
+        splits = np.cumsum(np.bincount(chunk_idx, minlength=len(chunk_keys)))[:-1]
+        for (chunk_x, chunk_y), cells in zip(chunk_keys.tolist(), np.split(order, splits)):
+            chunk = self.__chunks.get((chunk_x, chunk_y))
+            if chunk is None:
+                chunk = self.__chunks[(chunk_x, chunk_y)] = bytearray(PanelGrid.CHUNK_SIZE * PanelGrid.CHUNK_SIZE)
+            cells_view = np.frombuffer(chunk, dtype=np.uint8)
+            self.__painted_counter += int(np.count_nonzero(cells_view[offsets[cells]] == 0))
+            cells_view[offsets[cells]] = values[cells]
+
+        bounds = (int(xs.min()), int(xs.max()), int(ys.min()), int(ys.max()))
+        if self.__bounds is not None:
+            min_x, max_x, min_y, max_y = self.__bounds
+            bounds = (min(min_x, bounds[0]), max(max_x, bounds[1]), min(min_y, bounds[2]), max(max_y, bounds[3]))
+        self.__bounds = bounds
+
+    @property
+    def bounds(self):
+        # (min_x, max_x, min_y, max_y) of the painted panels
+        return self.__bounds
+
+    def rows(self):
+        # Raw rows over the bounds, top row first, cells keep the stored color + 1 encoding
+        if self.__bounds is None:
+            return
+        min_x, max_x, min_y, max_y = self.__bounds
+        first_chunk_x, last_chunk_x = min_x >> PanelGrid.CHUNK_BITS, max_x >> PanelGrid.CHUNK_BITS
+        start = min_x - (first_chunk_x << PanelGrid.CHUNK_BITS)
+        empty_row = bytes(PanelGrid.CHUNK_SIZE)
+        for y in range(min_y, max_y + 1):
+            chunk_y, row_offset = y >> PanelGrid.CHUNK_BITS, (y & PanelGrid.CHUNK_MASK) << PanelGrid.CHUNK_BITS
+            row = bytearray()
+            for chunk_x in range(first_chunk_x, last_chunk_x + 1):
+                chunk = self.__chunks.get((chunk_x, chunk_y))
+                row += empty_row if chunk is None else chunk[row_offset:row_offset + PanelGrid.CHUNK_SIZE]
+            yield row[start:start + max_x - min_x + 1]
+
+    def text(self, ink_color, ink='#', background=' '):
+        palette = PanelGrid.__palette(ink_color, ink.encode(), background.encode())
+        return '\n'.join(row.translate(palette).decode() for row in self.rows())
+
+    def save_pbm(self, file_path, ink_color):
+        # Binary PBM, ink panels are black pixels
+        width, height = self.__size()
+        bits = PanelGrid.__palette(ink_color, b'1', b'0')
+        row_length = (width + 7) // 8
+        with open(file_path, 'wb') as file:
+            file.write('P4\n{} {}\n'.format(width, height).encode())
+            for row in self.rows():
+                file.write((int(row.translate(bits), 2) << (row_length * 8 - width)).to_bytes(row_length, 'big'))
+
+    def save_png(self, file_path, ink_color):
+        # 8-bit grayscale PNG, ink panels are white pixels
+        width, height = self.__size()
+        pixels = PanelGrid.__palette(ink_color, b'\xff', b'\x00')
+        data = zlib.compress(b''.join(b'\x00' + row.translate(pixels) for row in self.rows()))
+
+        def chunk(tag, body):
+            return struct.pack('>I', len(body)) + tag + body + struct.pack('>I', zlib.crc32(tag + body))
+
+        with open(file_path, 'wb') as file:
+            file.write(b'\x89PNG\r\n\x1a\n')
+            file.write(chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 0, 0, 0, 0)))
+            file.write(chunk(b'IDAT', data))
+            file.write(chunk(b'IEND', b''))
+
+    @staticmethod
+    def __palette(ink_color, ink, background):
+        palette = bytearray(background * 256)
+        palette[ink_color + 1] = ink[0]
+        return bytes(palette)
+
+    def __size(self):
+        if self.__bounds is None:
+            return 0, 0
+        min_x, max_x, min_y, max_y = self.__bounds
+        return max_x - min_x + 1, max_y - min_y + 1
+
+    def __cell(self, pos):
+        x, y = pos
+        chunk = self.__chunks.get((x >> PanelGrid.CHUNK_BITS, y >> PanelGrid.CHUNK_BITS))
+        if chunk is None:
+            return 0
+        return chunk[((y & PanelGrid.CHUNK_MASK) << PanelGrid.CHUNK_BITS) | (x & PanelGrid.CHUNK_MASK)]
+
+
 class RouteTracker:
     BLACK = 0
     WHITE = 1
     TURN_RIGHT = 1
     TURN_LEFT = 0
 
-    def __init__(self):
+    # Headings are indices into the vectors, a turn adds +1 (right) or -1 (left) modulo 4
+    DIRECTIONS = ((0, 1), (1, 0), (0, -1), (-1, 0))
+    DIRECTION_LABELS = 'URDL'
+    TURNS = {TURN_RIGHT: 1, TURN_LEFT: -1}
+    DIRECTION_VECTORS = np.array(DIRECTIONS)
+
+    def __init__(self, trace_sink=None, start_color=WHITE):
         self.__is_even_step = False
         self.__current_pos = (0, 0)
         self.__panel_counter = 0
         self.__direction = 0
-        self.__visited_pos = {}
+        self.__panels = PanelGrid()
         self.__after_painting = -1
         self.__idx = 1
+        self.__trace_sink = trace_sink
+        self.__start_color = start_color
+        self.__events = {'reads': 0, 'paints': 0, 'moves': 0}
 
     def __call__(self, operation=None, **args):
         if operation is None:
             cur_color = -1
-            if self.__visited_pos:
+            if self.__panels:
                 # 249
-                cur_color = RouteTracker.BLACK \
-                    if self.__current_pos not in self.__visited_pos.keys() else \
-                    self.__visited_pos[self.__current_pos]
+                cur_color = self.__panels.get(self.__current_pos, RouteTracker.BLACK)
             else:
-                cur_color = RouteTracker.WHITE
-            print('{}'.format(cur_color), end=' ')
+                cur_color = self.__start_color
+            self.__events['reads'] += 1
+            if self.__trace_sink is not None:
+                self.__trace_sink.write('R {} {}\n'.format(self.__current_pos, cur_color))
             return cur_color
 
-        print('{}'.format(operation), end=' ')
         self.__move_operation(operation) if self.__is_even_step else self.__painting_operation(operation)
         self.__is_even_step = not self.__is_even_step
 
+    @property
+    def events(self):
+        return dict(self.__events)
+
     @property
     def panel_counter(self):
-        return len(self.__visited_pos.keys())
+        return len(self.__panels)
+
+    def apply_outputs(self, outputs):
+        # Whole (paint, turn) output stream at once, only valid when the program inputs do not depend on the
+        # colors it reads back
+        outputs = np.asarray(outputs, dtype=np.int64)
+        if self.__is_even_step or len(outputs) % 2:
+            raise Exception('Outputs have to come in (paint, turn) pairs')
+        if len(outputs) == 0:
+            return
+        colors, turns = outputs[0::2], outputs[1::2]
+        is_right = turns == RouteTracker.TURN_RIGHT
+        is_known = is_right | (turns == RouteTracker.TURN_LEFT)
+        if not is_known.all():
+            raise Exception('Not supported operation Op({})'.format(turns[~is_known][0]))
+
+        headings = (self.__direction + np.cumsum(np.where(is_right, 1, -1))) % 4
+        positions = np.cumsum(RouteTracker.DIRECTION_VECTORS[headings], axis=0) + self.__current_pos
+        painted_at = np.vstack([self.__current_pos, positions[:-1]])
+        self.__panels.paint_many(painted_at[:, 0], painted_at[:, 1], colors)
+
+        if self.__trace_sink is not None:
+            self.__trace_sink.write(''.join(
+                'P {} {}\nM {} {} {}\n'.format(pos, color, pos, heading, RouteTracker.DIRECTION_LABELS[heading])
+                for pos, color, heading in zip(map(tuple, painted_at.tolist()), colors.tolist(), headings.tolist())))
+        self.__events['paints'] += len(colors)
+        self.__events['moves'] += len(colors)
+        self.__current_pos = tuple(positions[-1].tolist())
+        self.__direction = int(headings[-1])
+
+    def image(self):
+        return self.__panels.text(RouteTracker.WHITE)
 
     def print(self):
-        min_x, max_x, min_y, max_y = 0, 0, 0, 0
-        for idx, position in enumerate(self.__visited_pos.keys()):
-            if idx == 0:
-                min_x, max_x, min_y, max_y = position[0], position[0], position[1], position[1]
-                continue
-            min_x = min(min_x, position[0])
-            max_x = max(max_x, position[0])
-            min_y = min(min_y, position[1])
-            max_y = max(max_y, position[1])
-        len_x = max_x - min_x + 1
-        len_y = max_y - min_y + 1
-
-        table = []
-        for idx in range(len_y):
-            table.append([' '] * len_x)
-        print(self.__visited_pos)
-        [setitem(table[(coord[1] - min_y)], (coord[0] - min_x), '#') for coord, color in self.__visited_pos.items() if color == RouteTracker.WHITE]
-        print(table)
-        print('\n'.join([''.join(row) for row in table]))
+        print(self.image())
+
+    def save_image(self, file_path):
+        if file_path.endswith('.png'):
+            self.__panels.save_png(file_path, RouteTracker.WHITE)
+        else:
+            self.__panels.save_pbm(file_path, RouteTracker.WHITE)
 
     def __painting_operation(self, color):
-        self.__visited_pos[self.__current_pos] = color
+        self.__panels[self.__current_pos] = color
+        self.__events['paints'] += 1
+        if self.__trace_sink is not None:
+            self.__trace_sink.write('P {} {}\n'.format(self.__current_pos, color))
 
     def __move_operation(self, direction):
-        if direction is RouteTracker.TURN_RIGHT:
-            self.__direction += 1
-        elif direction is RouteTracker.TURN_LEFT:
-            self.__direction += -1
-        else:
+        turn = RouteTracker.TURNS.get(direction)
+        if turn is None:
             raise Exception('Not supported operation Op({})'.format(direction))
-        self.__direction %= 4
-        {
-            0: lambda: self.__move((0, 1)),
-            1: lambda: self.__move((1, 0)),
-            2: lambda: self.__move((0, -1)),
-            3: lambda: self.__move((-1, 0))
-        }[self.__direction]()
-
-    def __move(self, vec):
-        direction = {
-            (0, 1): 'U',
-            (1, 0): 'R',
-            (0, -1): 'D',
-            (-1, 0): 'L'
-        }[vec]
-        print('{}:{}:{}'.format(self.__current_pos, self.__direction, direction))
-        self.__current_pos = (self.__current_pos[0] + vec[0], self.__current_pos[1] + vec[1])
+        self.__direction = (self.__direction + turn) % 4
+        self.__move()
+
+    def __move(self):
+        self.__events['moves'] += 1
+        if self.__trace_sink is not None:
+            self.__trace_sink.write('M {} {} {}\n'.format(self.__current_pos, self.__direction,
+                                                           RouteTracker.DIRECTION_LABELS[self.__direction]))
+        dx, dy = RouteTracker.DIRECTIONS[self.__direction]
+        self.__current_pos = (self.__current_pos[0] + dx, self.__current_pos[1] + dy)
+
+
+def paint_hull(job):
+    name, int_code, start_color = job
+    rt = RouteTracker(start_color=start_color)
+    vm = VirtualMachine(list(int_code), output_callback=rt, input_callback=rt, machine_name=name)
+    while vm.is_running():
+        vm.step()
+    return name, rt.panel_counter, rt.image(), rt.events
+
+
+def pool_main(argv, workers=None):
+    # 11_II.py --pool <program> [<program> ...] [--colors 0,1], every program is painted from every start color
+    colors = [RouteTracker.WHITE]
+    if '--colors' in argv:
+        colors_idx = argv.index('--colors')
+        colors = [int(color) for color in argv[colors_idx + 1].split(',')]
+        argv = argv[:colors_idx] + argv[colors_idx + 2:]
+
+    jobs = [('{}@{}'.format(file_path, color), parse_file(file_path), color)
+            for file_path in argv[2:] for color in colors]
+    results = []
+    with multiprocessing.Pool(workers) as pool:
+        for name, panel_counter, image, events in pool.imap_unordered(paint_hull, jobs):
+            print('Robot {} painted {} panels'.format(name, panel_counter))
+            results.append((name, panel_counter, image, events))
+
+    print()
+    for name, panel_counter, image, events in sorted(results):
+        print('{}: panels={} events={}'.format(name, panel_counter, events))
+        print(image)
+    print('Robots: {}, panels painted: {}'.format(len(results), sum(result[1] for result in results)))
+    if results:
+        print('Most panels: {}'.format(max(results, key=lambda result: result[1])[0]))
+
+
+def replay_main(argv):
+    # 11_II.py --replay-outputs <outputs> [<image>], outputs are recorded with --record-outputs
+    rt = RouteTracker()
+    rt.apply_outputs(np.fromfile(argv[2], dtype=np.int8))
+    rt.print()
+    if len(argv) > 3:
+        rt.save_image(argv[3])
+    print('Events: {}'.format(rt.events))
+    print('Max_output={}'.format(rt.panel_counter))
 
 
 def main(argv):
-    rt = RouteTracker()
+    if argv[1] == '--pool':
+        return pool_main(argv)
+    if argv[1] == '--replay-outputs':
+        return replay_main(argv)
+
+    trace_sink = None
+    if '--trace' in argv:
+        # The move log goes through a large write buffer, nothing is printed per instruction
+        trace_idx = argv.index('--trace')
+        trace_sink = open(argv[trace_idx + 1], 'w', buffering=1 << 20)
+        argv = argv[:trace_idx] + argv[trace_idx + 2:]
+
+    outputs, outputs_path = None, None
+    if '--record-outputs' in argv:
+        outputs_idx = argv.index('--record-outputs')
+        outputs, outputs_path = [], argv[outputs_idx + 1]
+        argv = argv[:outputs_idx] + argv[outputs_idx + 2:]
+
+    rt = RouteTracker(trace_sink)
+
+    def record_output(value, **args):
+        outputs.append(value)
+        rt(value)
+
     vm = VirtualMachine(parse_file(argv[1]), debug=False,
-                        output_callback=rt, input_callback=rt,
+                        output_callback=rt if outputs is None else record_output, input_callback=rt,
                         machine_name='Robot')
 
     # for _ in range(40):
     while vm.is_running():
         vm.step()
     rt.print()
+    if len(argv) > 2:
+        rt.save_image(argv[2])
+    if trace_sink is not None:
+        trace_sink.close()
+    if outputs is not None:
+        np.array(outputs, dtype=np.int8).tofile(outputs_path)
+    print('Events: {}'.format(rt.events))
     print('Max_output={}'.format(rt.panel_counter))
 
 
@@ -179,22 +179,167 @@ What is the total energy in the system after simulating the moons given in your
 '''
 
 import sys
+import json
+import time
+import tracemalloc
+import multiprocessing
 import numpy as np
-from matplotlib import pyplot as plt
 
-from copy import deepcopy
-from itertools import permutations
-from operator import setitem
+
+def gravity(coords, block_size=1 << 22):
+    # Every body is pulled by +1 towards each body with a greater coordinate and -1 towards each smaller one, rows of
+    # the broadcast are processed in blocks holding at most block_size entries; works for (n,) and (n, 3) arrays
+    deltas = np.empty_like(coords)
+    block = max(1, block_size // coords.size)
+    for first in range(0, len(coords), block):
+        deltas[first:first + block] = np.sign(coords[None] - coords[first:first + block, None]).sum(axis=1)
+    return deltas
+
+
+def sorted_gravity(coords):
+    # Same deltas as gravity in O(n log n): from a sorted copy of every axis the bodies with a smaller coordinate are
+    # the left insertion point and the greater ones are past the right insertion point, so ties count for neither
+    ordered = np.sort(coords, axis=0)
+    if coords.ndim == 1:
+        return len(coords) - np.searchsorted(ordered, coords, 'right') - np.searchsorted(ordered, coords, 'left')
+    deltas = np.empty_like(coords)
+    for axis in range(coords.shape[1]):
+        deltas[:, axis] = len(coords) - np.searchsorted(ordered[:, axis], coords[:, axis], 'right') - \
+                          np.searchsorted(ordered[:, axis], coords[:, axis], 'left')
+    return deltas
+
+
+GRAVITY_BACKENDS = {'broadcast': gravity, 'sorted': sorted_gravity}
+# Above this many bodies sorting beats the pairwise broadcast (see --benchmark)
+SORTED_GRAVITY_MIN_BODIES = 24
+
+
+def pick_gravity(bodies):
+    return sorted_gravity if bodies > SORTED_GRAVITY_MIN_BODIES else gravity
+
+
+def energy(coords, velocity):
+    # Total energy of a state, leading dimensions of batched states are kept
+    return (np.abs(coords).sum(axis=-1) * np.abs(velocity).sum(axis=-1)).sum(axis=-1)
+
+
+def step(coords, velocity):
+    velocity += pick_gravity(len(coords))(coords)
+    coords += velocity
+
+
+def packed_state(coords, velocity):
+    return np.concatenate([coords.ravel(), velocity.ravel()]).tobytes()
+
+
+def brent_cycle(coords, velocity):
+    # Brent's algorithm, only the state saved at the last power of two is kept; the hash of the packed state is
+    # compared first and the packed bytes only on a hash match. Returns the cycle start mu and length lambda
+    hare = (coords.copy(), velocity.copy())
+    saved = packed_state(*hare)
+    saved_hash = hash(saved)
+    step(*hare)
+    power = cycle_length = 1
+    while True:
+        state = packed_state(*hare)
+        state_hash = hash(state)
+        if state_hash == saved_hash and state == saved:
+            break
+        if power == cycle_length:
+            saved, saved_hash = state, state_hash
+            power *= 2
+            cycle_length = 0
+        step(*hare)
+        cycle_length += 1
+
+    tortoise, hare = (coords.copy(), velocity.copy()), (coords.copy(), velocity.copy())
+    for _ in range(cycle_length):
+        step(*hare)
+    cycle_start = 0
+    while packed_state(*tortoise) != packed_state(*hare):
+        step(*tortoise)
+        step(*hare)
+        cycle_start += 1
+    return cycle_start, cycle_length
+
+
+def axis_period(coords, velocity):
+    # Axes evolve independently and the system is reversible, so the first repeat is a return to the start state
+    initial_coords, initial_velocity = coords.copy(), velocity.copy()
+    coords, velocity = coords.copy(), velocity.copy()
+    axis_gravity = pick_gravity(len(coords))
+    steps = 0
+    while True:
+        velocity += axis_gravity(coords)
+        coords += velocity
+        steps += 1
+        if np.array_equal(coords, initial_coords) and np.array_equal(velocity, initial_velocity):
+            return steps
+
+
+class EnergyRecorder:
+    COLUMNS = ('time', 'potential', 'kinetic', 'total',
+               'potential_x', 'potential_y', 'potential_z', 'kinetic_x', 'kinetic_y', 'kinetic_z')
+
+    def __init__(self, capacity, sample_every=1, file_path=None):
+        # Samples go to a ring of preallocated rows, kept in memory or in a memory-mapped .npy file
+        shape = (capacity, len(EnergyRecorder.COLUMNS))
+        if file_path is None:
+            self.__samples = np.zeros(shape, dtype=np.int64)
+        else:
+            self.__samples = np.lib.format.open_memmap(file_path, mode='w+', dtype=np.int64, shape=shape)
+        self.__sample_every = sample_every
+        self.__counter = 0
+
+    def __len__(self):
+        return min(self.__counter, len(self.__samples))
+
+    @property
+    def sample_every(self):
+        return self.__sample_every
+
+    def record(self, first_time, coords_history, velocity_history):
+        # States of consecutive times starting at first_time, only the sampled times are stored
+        times = np.arange(first_time, first_time + len(coords_history))
+        is_sampled = times % self.__sample_every == 0
+        times = times[is_sampled]
+        if len(times) == 0:
+            return
+        coords, velocity = np.abs(coords_history[is_sampled]), np.abs(velocity_history[is_sampled])
+        potential, kinetic = coords.sum(axis=-1), velocity.sum(axis=-1)
+
+        capacity = len(self.__samples)
+        skipped = max(0, len(times) - capacity)
+        rows = np.empty((len(times) - skipped, len(EnergyRecorder.COLUMNS)), dtype=np.int64)
+        rows[:, 0] = times[skipped:]
+        rows[:, 1] = potential[skipped:].sum(axis=-1)
+        rows[:, 2] = kinetic[skipped:].sum(axis=-1)
+        rows[:, 3] = (potential[skipped:] * kinetic[skipped:]).sum(axis=-1)
+        rows[:, 4:7] = coords[skipped:].sum(axis=1)
+        rows[:, 7:10] = velocity[skipped:].sum(axis=1)
+        self.__samples[(self.__counter + skipped + np.arange(len(rows))) % capacity] = rows
+        self.__counter += len(times)
+
+    def samples(self):
+        # Stored rows from the oldest to the newest
+        if self.__counter <= len(self.__samples):
+            return np.array(self.__samples[:self.__counter])
+        return np.roll(self.__samples, -(self.__counter % len(self.__samples)), axis=0)
+
+    def flush(self):
+        if isinstance(self.__samples, np.memmap):
+            self.__samples.flush()
 
 
 class Universe:
 
-    def __init__(self, planets_coords):
-        self.__planets_coords = deepcopy(planets_coords)
-        self.__planets_velocity = [(0, 0, 0)] * len(self.__planets_coords)
+    def __init__(self, planets_coords, gravity_backend=None):
+        self.__planets_coords = np.array(planets_coords, dtype=np.int64).reshape(-1, 3)
+        self.__gravity = gravity_backend if gravity_backend is not None else pick_gravity(len(self.__planets_coords))
+        self.__planets_velocity = np.zeros_like(self.__planets_coords)
 
-        self.__initial_planets_coords = deepcopy(self.__planets_coords)
-        self.__initial_planets_velocity = [(0, 0, 0)] * len(self.__planets_coords)
+        self.__initial_planets_coords = self.__planets_coords.copy()
+        self.__initial_planets_velocity = self.__planets_velocity.copy()
 
         self.__x_repeated = -1
         self.__y_repeated = -1
@@ -207,54 +352,99 @@ class Universe:
         self.__move(delta_time)
         self.__elapsed_time += delta_time
 
-        pos_packed = zip(self.__initial_planets_coords, self.__planets_coords)
-        vel_packed = zip(self.__initial_planets_velocity, self.__planets_velocity)
-        are_repeated = [(x == x0, y == y0, z == z0) for (x0, y0, z0), (x, y, z) in pos_packed]
-        are_v_repeated = [(x == x0, y == y0, z == z0) for (x0, y0, z0), (x, y, z) in vel_packed]
-
-        is_x_repeated, is_vx_repeated = all([x for x, _, _ in are_repeated]), all([x for x, _, _ in are_v_repeated])
-        is_y_repeated, is_vy_repeated = all([y for _, y, _ in are_repeated]), all([y for _, y, _ in are_v_repeated])
-        is_z_repeated, is_vz_repeated = all([z for _, _, z in are_repeated]), all([z for _, _, z in are_v_repeated])
-
-        if is_x_repeated and is_vx_repeated and self.__x_repeated < 0:
-            self.__x_repeated = self.elapsed_time
-            print('X were repeated in ', self.elapsed_time)
-
-        if is_y_repeated and is_vy_repeated and self.__y_repeated < 0:
-            self.__y_repeated = self.elapsed_time
-            print('Y were repeated in ', self.elapsed_time)
-
-        if is_z_repeated and is_vz_repeated and self.__z_repeated < 0:
-            self.__z_repeated = self.elapsed_time
-            print('Z were repeated in ', self.elapsed_time)
-
-        if self.__x_repeated > 0 and self.__y_repeated > 0 and self.__z_repeated > 0:
-            print('Current time: ', self.elapsed_time)
-            print('Time repeat: ', self.__nww(self.__x_repeated, self.__nww(self.__y_repeated, self.__z_repeated)))
-            sys.exit(0)
+        self.__record_repeats(self.__planets_coords[None], self.__planets_velocity[None], self.elapsed_time)
+
+    def advance(self, steps, checkpoints=(), batch_size=4096, recorder=None):
+        # Runs the steps in one call, the inner loop only works on preallocated buffers; every batch of states is kept
+        # so repeats are looked up over the whole batch at once and energies are read back at the checkpoint times;
+        # a checkpoint at the current elapsed time gets the current energy
+        if steps < 0:
+            raise ValueError('Cannot advance by {} steps'.format(steps))
+        if any(checkpoint < self.__elapsed_time for checkpoint in checkpoints):
+            raise ValueError('Checkpoints before the elapsed time {} are already gone'.format(self.__elapsed_time))
+
+        coords, velocity = self.__planets_coords, self.__planets_velocity
+        batch_size = max(1, min(batch_size, steps))
+        coords_history = np.empty((batch_size,) + coords.shape, dtype=np.int64)
+        velocity_history = np.empty_like(coords_history)
+        is_small = self.__gravity is gravity and coords.size * len(coords) <= 1 << 22
+        if is_small:
+            pairs = np.empty((len(coords),) + coords.shape, dtype=np.int64)
+            deltas = np.empty_like(coords)
+
+        energies = {checkpoint: self.total_energy for checkpoint in checkpoints if checkpoint == self.__elapsed_time}
+        checkpoints = np.array(sorted(checkpoints), dtype=np.int64)
+        while steps > 0:
+            batch = min(batch_size, steps)
+            for step in range(batch):
+                if is_small:
+                    np.subtract(coords[None], coords[:, None], out=pairs)
+                    np.sign(pairs, out=pairs)
+                    pairs.sum(axis=1, out=deltas)
+                    velocity += deltas
+                else:
+                    velocity += self.__gravity(coords)
+                coords += velocity
+                coords_history[step] = coords
+                velocity_history[step] = velocity
+
+            first_time = self.__elapsed_time + 1
+            self.__elapsed_time += batch
+            steps -= batch
+            self.__record_repeats(coords_history[:batch], velocity_history[:batch], first_time)
+            if recorder is not None:
+                recorder.record(first_time, coords_history[:batch], velocity_history[:batch])
+
+            times = checkpoints[(checkpoints >= first_time) & (checkpoints <= self.__elapsed_time)]
+            batch_energies = energy(coords_history[times - first_time], velocity_history[times - first_time])
+            energies.update(zip(times.tolist(), batch_energies.tolist()))
+        return energies
+
+    def find_period(self, workers=3):
+        # Periods of the x, y and z axes found in parallel, the whole system repeats after their LCM
+        axes = [(self.__planets_coords[:, axis].copy(), self.__planets_velocity[:, axis].copy()) for axis in range(3)]
+        if workers == 1:
+            periods = [axis_period(*axis) for axis in axes]
+        else:
+            with multiprocessing.Pool(workers) as pool:
+                periods = pool.starmap(axis_period, axes)
+        return tuple(periods), self.__nww(periods[0], self.__nww(periods[1], periods[2]))
+
+    def find_cycle(self, workers=3):
+        # Brent's cycle per axis, the whole system enters its cycle when the last axis does and repeats after the
+        # LCM of the axis cycle lengths; does not rely on the system being reversible
+        axes = [(self.__planets_coords[:, axis].copy(), self.__planets_velocity[:, axis].copy()) for axis in range(3)]
+        if workers == 1:
+            cycles = [brent_cycle(*axis) for axis in axes]
+        else:
+            with multiprocessing.Pool(workers) as pool:
+                cycles = pool.starmap(brent_cycle, axes)
+        lengths = [cycle_length for _, cycle_length in cycles]
+        return tuple(cycles), max(cycle_start for cycle_start, _ in cycles), \
+            self.__nww(lengths[0], self.__nww(lengths[1], lengths[2]))
+
+    def __record_repeats(self, coords_history, velocity_history, first_time):
+        is_repeated = ((coords_history == self.__initial_planets_coords) &
+                       (velocity_history == self.__initial_planets_velocity)).all(axis=1)
+        first_repeats = np.where(is_repeated.any(axis=0), is_repeated.argmax(axis=0) + first_time, -1).tolist()
+
+        if first_repeats[0] > 0 and self.__x_repeated < 0:
+            self.__x_repeated = first_repeats[0]
+            print('X were repeated in ', self.__x_repeated)
+
+        if first_repeats[1] > 0 and self.__y_repeated < 0:
+            self.__y_repeated = first_repeats[1]
+            print('Y were repeated in ', self.__y_repeated)
+
+        if first_repeats[2] > 0 and self.__z_repeated < 0:
+            self.__z_repeated = first_repeats[2]
+            print('Z were repeated in ', self.__z_repeated)
 
     def __calculate_velocity(self, until_repeat=False):
-        velocitator = lambda a, b: 1 if a < b else -1 if a > b else 0
-        for (a_idx, b_idx) in permutations(range(len(self.__planets_coords)), 2):
-            self.__planets_velocity[a_idx] = (
-                self.__planets_velocity[a_idx][0] + velocitator(
-                    self.__planets_coords[a_idx][0], self.__planets_coords[b_idx][0]),
-                self.__planets_velocity[a_idx][1] + velocitator(
-                    self.__planets_coords[a_idx][1], self.__planets_coords[b_idx][1]),
-                self.__planets_velocity[a_idx][2] + velocitator(
-                    self.__planets_coords[a_idx][2], self.__planets_coords[b_idx][2]),
-            )
+        self.__planets_velocity += self.__gravity(self.__planets_coords)
 
     def __move(self, delta_time):
-        [setitem(self.__planets_coords, idx, (
-            (
-                (
-                    (coords[0] + (vel[0] * delta_time)),
-                    (coords[1] + (vel[1] * delta_time)),
-                    (coords[2] + (vel[2] * delta_time))
-                )
-            )
-        )) for idx, (coords, vel) in enumerate(zip(self.__planets_coords, self.__planets_velocity))]
+        self.__planets_coords += self.__planets_velocity * delta_time
 
     def __nwd(self, a, b):
         while b != 0:
@@ -268,25 +458,32 @@ class Universe:
 
     @property
     def total_energy(self):
-        total_energy = 0
-        for (coord, vel) in zip(self.__planets_coords, self.__planets_velocity):
-            total_energy += (abs(coord[0]) + abs(coord[1]) + abs(coord[2])) * (abs(vel[0]) + abs(vel[1]) + abs(vel[2]))
-        return total_energy
+        return int(energy(self.__planets_coords, self.__planets_velocity))
 
     @property
     def universe_repeated_itself(self):
-        if self.__elapsed_time is 0:
+        if self.__elapsed_time == 0:
             return False
-        is_coords_same = all(a == b for (a, b) in zip(self.__initial_planets_coords, self.__planets_coords))
-        is_velocity_same = all(a == b for (a, b) in zip(self.__initial_planets_velocity, self.__planets_velocity))
+        is_coords_same = np.array_equal(self.__initial_planets_coords, self.__planets_coords)
+        is_velocity_same = np.array_equal(self.__initial_planets_velocity, self.__planets_velocity)
         return is_coords_same and is_velocity_same
 
+    @property
+    def repeat_time(self):
+        if self.__x_repeated < 0 or self.__y_repeated < 0 or self.__z_repeated < 0:
+            return -1
+        return self.__nww(self.__x_repeated, self.__nww(self.__y_repeated, self.__z_repeated))
+
+    @property
+    def bodies(self):
+        return len(self.__planets_coords)
+
     @property
     def elapsed_time(self):
         return self.__elapsed_time
 
     def print(self):
-        return self.__planets_coords, self.__planets_velocity
+        return list(map(tuple, self.__planets_coords.tolist())), list(map(tuple, self.__planets_velocity.tolist()))
 
 
 def parse_file(file_path: str):
@@ -301,13 +498,116 @@ def parse_file(file_path: str):
     return coords
 
 
-def main(argv):
-    ss = Universe(parse_file(argv[1]))
+def random_scan(bodies, spread=1000, seed=None):
+    rng = np.random.default_rng(seed)
+    return list(map(tuple, rng.integers(-spread, spread + 1, size=(bodies, 3)).tolist()))
+
+
+def benchmark(sizes=(4, 16, 64, 256, 1024, 4096, 10000), backends=None, pair_budget=10 ** 7, seed=0):
+    # Step throughput of Universe.advance and peak traced memory of a single step for every backend on random systems;
+    # the number of steps shrinks with the square of the system size so every run costs about the same for the
+    # pairwise gravity. Tracing slows the backends unevenly, so the throughput comes from an untraced run; the memory
+    # is traced on one step with a one step history, the history buffers of a longer run would follow the step count
+    # instead of the gravity term
+    results = []
+    for bodies in sizes:
+        scan = random_scan(bodies, seed=seed)
+        steps = max(1, min(1000, pair_budget // (bodies * bodies)))
+        for name, backend in (backends or GRAVITY_BACKENDS).items():
+            universe = Universe(scan, backend)
+            start = time.perf_counter()
+            universe.advance(steps)
+            seconds = time.perf_counter() - start
+
+            universe = Universe(scan, backend)
+            tracemalloc.start()
+            universe.advance(1, batch_size=1)
+            _, peak_memory = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+            results.append({'bodies': bodies, 'backend': name, 'steps': steps, 'seconds': seconds,
+                            'steps_per_second': steps / seconds, 'peak_memory': peak_memory})
+            print('{:>6} bodies {:>10}: {:>12.1f} steps/s {:>12} B'.format(bodies, name, steps / seconds, peak_memory))
+    return results
+
+
+def benchmark_main(argv):
+    # 12_II.py --benchmark <results.json> [--sizes 4,64,1024]
+    sizes = [int(size) for size in argv[argv.index('--sizes') + 1].split(',')] if '--sizes' in argv else None
+    results = benchmark(sizes) if sizes else benchmark()
+    with open(argv[argv.index('--benchmark') + 1], 'w') as f:
+        json.dump(results, f, indent=2)
+
+
+def sweep_universe(job):
+    # Workers of the sweep pool are daemons and cannot start their own pool, so the axes are searched one by one
+    # find_period works on copies of the axes, so the same universe is then advanced for the energy
+    file_path, steps = job
+    universe = Universe(parse_file(file_path))
+    periods, repeat_time = universe.find_period(workers=1)
+    energy_after = universe.advance(steps, checkpoints=[steps])[steps]
+    return {'scan': file_path, 'bodies': universe.bodies, 'periods': periods, 'repeat_time': repeat_time,
+            'energy': energy_after}
+
+
+def sweep(file_paths, steps=1000, workers=None):
+    # Yields every universe as soon as a worker finishes it
+    with multiprocessing.Pool(workers) as pool:
+        yield from pool.imap_unordered(sweep_universe, [(file_path, steps) for file_path in file_paths])
+
+
+def sweep_main(argv):
+    # 12_II.py --sweep <scan> [<scan> ...] [--steps <energy steps>]
+    steps = 1000
+    if '--steps' in argv:
+        steps_idx = argv.index('--steps')
+        steps = int(argv[steps_idx + 1])
+        argv = argv[:steps_idx] + argv[steps_idx + 2:]
+
+    rows = []
+    for row in sweep(argv[2:], steps):
+        print('{scan}: periods={periods} repeat={repeat_time} energy={energy}'.format(**row))
+        rows.append(row)
+
+    print()
+    print('{:<40} {:>6} {:>24} {:>20} {:>12}'.format('scan', 'bodies', 'periods', 'repeat', 'energy'))
+    for row in sorted(rows, key=lambda row: row['repeat_time'], reverse=True):
+        print('{:<40} {:>6} {:>24} {:>20} {:>12}'.format(row['scan'], row['bodies'], str(row['periods']),
+                                                          row['repeat_time'], row['energy']))
 
-    while True:
-        ss.elapse()
 
-    print('Elapsed Time: ', ss.elapsed_time)
+def main(argv):
+    if '--benchmark' in argv:
+        return benchmark_main(argv)
+    if argv[1] == '--sweep':
+        return sweep_main(argv)
+
+    ss = Universe(parse_file(argv[1]))
+    if '--brent' in argv:
+        cycles, cycle_start, cycle_length = ss.find_cycle()
+        for axis_name, (axis_start, axis_length) in zip('XYZ', cycles):
+            print('{} cycle: mu={} lambda={}'.format(axis_name, axis_start, axis_length))
+        print('Cycle: mu={} lambda={}'.format(cycle_start, cycle_length))
+        return
+    if len(argv) > 2:
+        # 12_II.py <scan> <steps> [--energy-log <file.npy>] [--sample <every>]
+        steps = int(argv[2])
+        recorder = None
+        if '--energy-log' in argv:
+            sample_every = int(argv[argv.index('--sample') + 1]) if '--sample' in argv else 1
+            recorder = EnergyRecorder(max(1, steps // sample_every), sample_every,
+                                      argv[argv.index('--energy-log') + 1])
+        print('Energy after {} steps: '.format(steps), ss.advance(steps, checkpoints=[steps], recorder=recorder)[steps])
+        if recorder is not None:
+            recorder.flush()
+            print('Energy samples: ', len(recorder))
+        return
+
+    (x_period, y_period, z_period), repeat_time = ss.find_period()
+    print('X were repeated in ', x_period)
+    print('Y were repeated in ', y_period)
+    print('Z were repeated in ', z_period)
+    print('Time repeat: ', repeat_time)
 
 
 if __name__ == "__main__":
@@ -34,11 +34,150 @@ Beat the game by breaking all the blocks. What is your score after the last bloc
 
 import sys
 import os
+import pickle
+import multiprocessing
+
+from array import array
 
 from collections import deque
 from operator import setitem
 
 
+class PagedMemory(list):
+    PAGE_SIZE = 1024
+
+    def __init__(self, values=(), page_size=PAGE_SIZE):
+        super().__init__(values)
+        self.__page_size = page_size
+        # Dirty pages are cleared after every checkpoint, changed pages track writes since construction for diff
+        self.__dirty = bytearray(self.__pages_count(len(self)))
+        self.__changed = bytearray(self.__pages_count(len(self)))
+
+    def __reduce__(self):
+        # The default list pickling calls extend before the bitmaps exist, the values go through __init__ instead
+        return self.__class__, (list(self), self.__page_size), (bytes(self.__dirty), bytes(self.__changed))
+
+    def __setstate__(self, state):
+        self.__dirty, self.__changed = bytearray(state[0]), bytearray(state[1])
+
+    @property
+    def page_size(self):
+        return self.__page_size
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        if isinstance(key, slice):
+            start, stop, _ = key.indices(len(self))
+            for page_idx in range(start // self.__page_size, (stop - 1) // self.__page_size + 1):
+                self.__dirty[page_idx] = 1
+                self.__changed[page_idx] = 1
+        else:
+            self.__dirty[key // self.__page_size] = 1
+            self.__changed[key // self.__page_size] = 1
+
+    def extend(self, values):
+        super().extend(values)
+        self.__dirty.extend(bytes(self.__pages_count(len(self)) - len(self.__dirty)))
+        self.__changed.extend(bytes(self.__pages_count(len(self)) - len(self.__changed)))
+
+    def page(self, page_idx):
+        return self[page_idx * self.__page_size:(page_idx + 1) * self.__page_size]
+
+    def dirty_pages(self):
+        page_idx = self.__dirty.find(1)
+        while page_idx >= 0:
+            yield page_idx
+            page_idx = self.__dirty.find(1, page_idx + 1)
+
+    def clear_dirty(self):
+        for page_idx in list(self.dirty_pages()):
+            self.__dirty[page_idx] = 0
+
+    def changed_pages(self):
+        page_idx = self.__changed.find(1)
+        while page_idx >= 0:
+            yield page_idx
+            page_idx = self.__changed.find(1, page_idx + 1)
+
+    def diff(self, other):
+        # Both memories are expected to be built from the same image, only pages written on either side since then
+        # are compared; checkpoints clear the dirty pages but not the changed ones
+        changed_pages = sorted(set(self.changed_pages()) | set(other.changed_pages()))
+        for page_idx in changed_pages:
+            first = page_idx * self.__page_size
+            for offset, (mine, theirs) in enumerate(zip(self.page(page_idx), other.page(page_idx))):
+                if mine != theirs:
+                    yield first + offset, mine, theirs
+
+    def __pages_count(self, length):
+        return (length + self.__page_size - 1) // self.__page_size
+
+
+class Checkpointer:
+
+    def __init__(self, file_path, interval=100000, compact_every=64, sync=False):
+        self.__file_path = file_path
+        self.__interval = interval
+        self.__compact_every = compact_every
+        self.__sync = sync
+        self.__records_since_base = -1
+
+    @property
+    def interval(self):
+        return self.__interval
+
+    def exists(self):
+        return os.path.exists(self.__file_path)
+
+    def save(self, state, memory):
+        # The log starts (and is periodically rewritten) with a full memory image; every later record only
+        # carries the pages written since the previous checkpoint, so the cost follows the write set.
+        if self.__records_since_base < 0 or self.__records_since_base >= self.__compact_every:
+            self.__write_base(state, memory)
+            return
+
+        pages = {page: memory.page(page) for page in memory.dirty_pages()}
+        with open(self.__file_path, 'ab') as f:
+            pickle.dump(('delta', state, pages), f, protocol=pickle.HIGHEST_PROTOCOL)
+            self.__flush(f)
+        self.__records_since_base += 1
+
+    def load(self):
+        state, memory = None, None
+        with open(self.__file_path, 'rb') as f:
+            while True:
+                try:
+                    kind, record_state, payload = pickle.load(f)
+                except (EOFError, pickle.UnpicklingError):
+                    # A record cut in half by a crash is dropped, the previous one is still consistent
+                    break
+                if kind == 'base':
+                    memory = PagedMemory(payload)
+                else:
+                    page_size = memory.page_size
+                    for page, content in payload.items():
+                        memory[page * page_size:page * page_size + len(content)] = content
+                state = record_state
+
+        if state is None:
+            raise Exception('Checkpoint {} is empty'.format(self.__file_path))
+        self.__records_since_base = self.__compact_every
+        return state, memory
+
+    def __write_base(self, state, memory):
+        tmp_path = self.__file_path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(('base', state, list(memory)), f, protocol=pickle.HIGHEST_PROTOCOL)
+            self.__flush(f)
+        os.replace(tmp_path, self.__file_path)
+        self.__records_since_base = 0
+
+    def __flush(self, f):
+        f.flush()
+        if self.__sync:
+            os.fsync(f.fileno())
+
+
 class VirtualMachine:
 
     def __init__(self,
@@ -46,15 +185,20 @@ class VirtualMachine:
                  program_alarm=False,
                  noun=12, verb=2, quarters=None, debug=False,
                  output_callback=lambda: print, input_callback=lambda: input,
-                 machine_name=''):
+                 machine_name='', checkpointer=None, checkpoint_state=lambda: None, input_queue=None,
+                 output_arity=1):
         self.__debug_mode = debug
         self.__machine_name = machine_name
         self.__debug('Debug Mode... ')
 
         self.__output_callback = output_callback
         self.__pipe_input_callback = input_callback
+        self.__input_queue = input_queue if input_queue is not None else deque()
+        self.__output_arity = output_arity
+        self.__output_record = []
+        self.__output_batch = []
 
-        self.__int_code = int_code
+        self.__int_code = PagedMemory(int_code)
         self.__int_code.extend([0] * 10000)  # TODO resize
         self.__is_running = True
         self.__pc = 0
@@ -69,9 +213,35 @@ class VirtualMachine:
             self.__int_code[1] = noun
             self.__int_code[2] = verb
 
+        self.__checkpointer = checkpointer
+        self.__checkpoint_state = checkpoint_state
+
+    @classmethod
+    def resume(cls, checkpointer, **kwargs):
+        state, memory = checkpointer.load()
+        vm = cls([], checkpointer=checkpointer, **kwargs)
+        vm.__restore(state, memory)
+        vm.__int_code.clear_dirty()
+        return vm, state['extra']
+
+    @classmethod
+    def from_snapshot(cls, snapshot, **kwargs):
+        vm = cls([], **kwargs)
+        vm.__restore(snapshot, PagedMemory(snapshot['memory']))
+        return vm
+
+    def snapshot(self):
+        snapshot = self.__state()
+        snapshot['memory'] = list(self.__int_code)
+        return snapshot
+
     def is_running(self):
         return self.__is_running
 
+    def set_callbacks(self, output_callback, input_callback):
+        self.__output_callback = output_callback
+        self.__pipe_input_callback = input_callback
+
     def step(self):
         self.__last_pc = self.__pc
 
@@ -80,6 +250,44 @@ class VirtualMachine:
         self.__pc += operate_length
         self.__step_counter += 1
 
+        if self.__checkpointer is not None and \
+                (self.__step_counter % self.__checkpointer.interval == 0 or not self.__is_running):
+            self.checkpoint()
+
+    def run(self):
+        while self.__is_running:
+            self.step()
+
+    def run_until_input(self):
+        # Executes in one call until the next instruction asks for input or the machine halts; the checkpoint check
+        # runs once at the end instead of after every instruction
+        int_code = self.__int_code
+        operate = self.__operate
+        start_step = self.__step_counter
+        while self.__is_running and int_code[self.__pc] % 100 != 3:
+            self.__last_pc = self.__pc
+            operate_length = operate()
+            self.__pc += operate_length
+            self.__step_counter += 1
+
+        if self.__checkpointer is not None and self.__step_counter != start_step:
+            interval = self.__checkpointer.interval
+            if self.__step_counter // interval != start_step // interval or not self.__is_running:
+                self.checkpoint()
+        self.flush_output()
+
+    def flush_output(self):
+        # Complete records gathered since the last flush are handed over in one call as a list of tuples
+        if self.__output_batch:
+            batch, self.__output_batch = self.__output_batch, []
+            self.__output_callback(batch)
+
+    def checkpoint(self):
+        state = self.__state()
+        state['extra'] = self.__checkpoint_state()
+        self.__checkpointer.save(state, self.__int_code)
+        self.__int_code.clear_dirty()
+
     def first_position(self):
         first_pos = 0
         return self.__int_code[first_pos]
@@ -137,7 +345,9 @@ class VirtualMachine:
         return 1
 
     def __input(self):
-        val = self.__pipe_input_callback()
+        self.flush_output()
+        # Queued inputs are consumed without leaving the VM, the callback is asked only when the queue is empty
+        val = self.__input_queue.popleft() if self.__input_queue else self.__pipe_input_callback()
         self.__debug('Read: {}'.format(val))
 
         self.__write_arg(val)
@@ -145,7 +355,14 @@ class VirtualMachine:
 
     def __print(self):
         arg1 = self.__read_arg()
-        self.__output_callback(arg1, end='')
+        if self.__output_arity == 1:
+            self.__output_callback(arg1, end='')
+            return 1
+
+        self.__output_record.append(arg1)
+        if len(self.__output_record) == self.__output_arity:
+            self.__output_batch.append(tuple(self.__output_record))
+            self.__output_record.clear()
         return 1
 
     def __jmp_if_true(self):
@@ -190,6 +407,7 @@ class VirtualMachine:
 
     def __exit(self):
         self.__is_running = False
+        self.flush_output()
         return 1
 
     # Helpers
@@ -215,6 +433,28 @@ class VirtualMachine:
             2: lambda: setitem(self.__int_code, self.__int_code[self.__pc] + self.__relative_base, val),
         }[self.__arg_mode_stack.pop()]()
 
+    def __state(self):
+        return {
+            'pc': self.__pc,
+            'last_pc': self.__last_pc,
+            'relative_base': self.__relative_base,
+            'step_counter': self.__step_counter,
+            'is_running': self.__is_running,
+            'input': list(self.__input_queue),
+            'output': [list(self.__output_record), list(self.__output_batch)],
+        }
+
+    def __restore(self, state, memory):
+        self.__int_code = memory
+        self.__pc = state['pc']
+        self.__last_pc = state['last_pc']
+        self.__relative_base = state['relative_base']
+        self.__step_counter = state['step_counter']
+        self.__is_running = state['is_running']
+        self.__input_queue.clear()
+        self.__input_queue.extend(state.get('input', ()))
+        self.__output_record, self.__output_batch = state.get('output', ([], []))
+
     def __debug(self, message):
         if self.__debug_mode:
             print('D_{}:{}'.format(self.__machine_name, message))
@@ -240,7 +480,9 @@ class CarePackager:
     BLOCK_PADDLE = 3
     BLOCK_BALL = 4
 
-    def __init__(self):
+    TILES = ' |o-x'
+
+    def __init__(self, board_size=(64, 32)):
         self.__current_pos = (0, 0)
         self.__current_command_number = 0
         self.__x_tile = -1
@@ -248,11 +490,13 @@ class CarePackager:
         self.__id_tile = -1
         self.__x_ball = 0
         self.__score = 0
-        self.__board_elements = {}
-        self.__print_queue = deque()
-        self.__board_size = (-1, -1)
+        self.__board_size = board_size
+        self.__board = bytearray(board_size[0] * board_size[1])
+        self.__used_size = (0, 0)
+        self.__blocks_counter = 0
+        self.__changed_cells = set()
+        self.__is_screen_cleared = False
         self.__board_ready = False
-        self.__printable_board = []
 
     def __call__(self, operation=None, **args):
         if operation is None:
@@ -270,38 +514,58 @@ class CarePackager:
             raise Exception('Command number is not used')
         self.__current_command_number += 1
 
+    def draw(self, records):
+        for self.__x_tile, self.__y_tile, self.__id_tile in records:
+            self.__draw()
+
     def print(self):
         if not self.__board_ready:
             return [['']]
 
-        self.__normalize_board()
-        # [setitem(self.__printable_board[pos[1]], pos[0], self.__tile(tile)) for pos, tile in self.__board_elements.items()]
-        [setitem(self.__printable_board[y], x, self.__tile(tile)) for x, y, tile in self.__print_queue]
-
-        return self.__printable_board
+        x_len, y_len = self.__used_size
+        width = self.__board_size[0]
+        return [[CarePackager.TILES[el_id] for el_id in self.__board[y * width:y * width + x_len]]
+                for y in range(y_len)]
+
+    def render(self, stream=sys.stdout):
+        # Only cells changed since the previous frame are sent, one cursor jump per run of neighbours in a row
+        width = self.__board_size[0]
+        if not self.__is_screen_cleared:
+            stream.write('\x1b[2J')
+            self.__changed_cells.update(y * width + x for y in range(self.__used_size[1])
+                                        for x in range(self.__used_size[0]))
+            self.__is_screen_cleared = True
+
+        frame = []
+        run_start, run_end = -1, -1
+        for cell in sorted(self.__changed_cells):
+            if cell == run_end and cell % width != 0:
+                run_end += 1
+                continue
+            if run_start >= 0:
+                frame.append(self.__render_run(run_start, run_end))
+            run_start, run_end = cell, cell + 1
+        if run_start >= 0:
+            frame.append(self.__render_run(run_start, run_end))
+        self.__changed_cells.clear()
+
+        frame.append('\x1b[{};1HScore: {}\x1b[K'.format(self.__used_size[1] + 1, self.__score))
+        stream.write(''.join(frame))
+        stream.flush()
 
     def score(self):
         return self.__score
 
     def count_printable_blocks(self):
-        return len([el_id for key, el_id in self.__board_elements.items() if el_id == CarePackager.BLOCK_TILE])
+        return self.__blocks_counter
 
     def is_ready(self):
         return self.__board_ready
 
-    def __normalize_board(self):
-        if not self.__board_size == (-1, -1):
-            return
-
-        x_max = -1
-        y_max = -1
-        for x, y in self.__board_elements.keys():
-            x_max = max(x_max, x + 1)
-            y_max = max(y_max, y + 1)
-
-        self.__board_size = (x_max, y_max)
-        [self.__printable_board.append([' '] * self.__board_size[0]) for _ in range(self.__board_size[1])]
-        print('Board size', self.__board_size)
+    def __render_run(self, run_start, run_end):
+        width = self.__board_size[0]
+        tiles = ''.join(CarePackager.TILES[el_id] for el_id in self.__board[run_start:run_end])
+        return '\x1b[{};{}H{}'.format(run_start // width + 1, run_start % width + 1, tiles)
 
     def __draw(self):
         if self.__x_tile == -1:
@@ -314,25 +578,441 @@ class CarePackager:
         if self.__id_tile == CarePackager.BLOCK_PADDLE:
             self.__x_paddle = self.__x_tile
 
-        self.__board_elements[(self.__x_tile, self.__y_tile)] = self.__id_tile
-        self.__print_queue.append((self.__x_tile, self.__y_tile, self.__id_tile))
+        width, height = self.__board_size
+        if not (0 <= self.__x_tile < width and 0 <= self.__y_tile < height):
+            raise Exception('Tile {};{} is out of board {}'.format(self.__x_tile, self.__y_tile, self.__board_size))
 
+        cell = self.__y_tile * width + self.__x_tile
+        previous_id = self.__board[cell]
+        if previous_id == self.__id_tile:
+            return
+        self.__blocks_counter += (self.__id_tile == CarePackager.BLOCK_TILE) - (previous_id == CarePackager.BLOCK_TILE)
+        self.__board[cell] = self.__id_tile
+        self.__changed_cells.add(cell)
+        self.__used_size = (max(self.__used_size[0], self.__x_tile + 1), max(self.__used_size[1], self.__y_tile + 1))
 
-    def __tile(self, el_id):
-        return {
-            CarePackager.BLOCK_EMPTY: ' ',
-            CarePackager.BLOCK_WALL: '|',
-            CarePackager.BLOCK_TILE: 'o',
-            CarePackager.BLOCK_PADDLE: '-',
-            CarePackager.BLOCK_BALL: 'x',
-        }[el_id]
+
+class HeadlessCarePackager:
+    Parameter_1st = 0
+    Parameter_2nd = 1
+    Parameter_3rd = 2
+
+    def __init__(self, policy=None):
+        self.__current_command_number = 0
+        self.__x_tile = -1
+        self.__y_tile = -1
+        self.__ball = (0, 0)
+        self.__last_ball = None
+        self.__paddle = (0, 0)
+        self.__x_wall_max = 0
+        self.__score = 0
+        self.__blocks = set()
+        self.__board_ready = False
+        self.__policy = policy
+
+    def __call__(self, operation=None, **args):
+        if operation is None:
+            self.__board_ready = True
+            if self.__policy is not None:
+                return self.__policy(self)
+            return self.__ball[0] - self.__paddle[0]
+
+        command = self.__current_command_number % 3
+        self.__current_command_number += 1
+        if command == HeadlessCarePackager.Parameter_1st:
+            self.__x_tile = operation
+        elif command == HeadlessCarePackager.Parameter_2nd:
+            self.__y_tile = operation
+        else:
+            self.__draw(operation)
+
+    def draw(self, records):
+        for self.__x_tile, self.__y_tile, id_tile in records:
+            self.__draw(id_tile)
+
+    def score(self):
+        return self.__score
+
+    def count_printable_blocks(self):
+        return len(self.__blocks)
+
+    def is_ready(self):
+        return self.__board_ready
+
+    def set_policy(self, policy):
+        self.__policy = policy
+
+    @property
+    def ball(self):
+        return self.__ball
+
+    @property
+    def last_ball(self):
+        return self.__last_ball
+
+    @property
+    def paddle(self):
+        return self.__paddle
+
+    @property
+    def blocks(self):
+        return self.__blocks
+
+    @property
+    def x_wall_max(self):
+        return self.__x_wall_max
+
+    def __draw(self, id_tile):
+        if self.__x_tile == -1:
+            self.__score = id_tile
+            return
+
+        if id_tile == CarePackager.BLOCK_TILE:
+            self.__blocks.add((self.__x_tile, self.__y_tile))
+            return
+        # Any other tile drawn over a block position means the block is gone
+        self.__blocks.discard((self.__x_tile, self.__y_tile))
+
+        if id_tile == CarePackager.BLOCK_BALL:
+            self.__last_ball = self.__ball
+            self.__ball = (self.__x_tile, self.__y_tile)
+        elif id_tile == CarePackager.BLOCK_PADDLE:
+            self.__paddle = (self.__x_tile, self.__y_tile)
+        elif id_tile == CarePackager.BLOCK_WALL:
+            self.__x_wall_max = max(self.__x_wall_max, self.__x_tile)
+
+
+def render_main(vm, cp):
+    while vm.is_running():
+        vm.run_until_input()
+        cp.render()
+        if vm.is_running():
+            vm.step()
+
+    print()
+    print('Printable blocks left: ', cp.count_printable_blocks())
+    print('Score: ', cp.score())
+
+
+def track_ball_policy(cp):
+    return cp.ball[0] - cp.paddle[0]
+
+
+def ball_path(cp, max_frames=256):
+    # Ball positions in the coming frames until it lands above the paddle row; the ball bounces off the walls,
+    # the ceiling, the paddle and vertically off the blocks it breaks
+    (x, y), y_paddle = cp.ball, cp.paddle[1]
+    if cp.last_ball is None or cp.x_wall_max < 2:
+        return []
+    dx, dy = x - cp.last_ball[0], y - cp.last_ball[1]
+    if abs(dx) != 1 or abs(dy) != 1:
+        return []
+
+    x_min, x_max, y_min = 1, cp.x_wall_max - 1, 1
+    blocks = set(cp.blocks)
+    path = []
+    while len(path) < max_frames:
+        if not x_min <= x + dx <= x_max:
+            dx = -dx
+        if not y_min <= y + dy < y_paddle:
+            dy = -dy
+        elif (x + dx, y + dy) in blocks:
+            blocks.discard((x + dx, y + dy))
+            dy = -dy
+        x, y = x + dx, y + dy
+        path.append((x, y))
+        if y == y_paddle - 1 and dy > 0:
+            break
+    return path
+
+
+def predict_landing_x(cp):
+    path = ball_path(cp)
+    return path[-1][0] if path else cp.ball[0]
+
+
+def landing_point_policy(cp):
+    x_target, x_paddle = predict_landing_x(cp), cp.paddle[0]
+    return (x_target > x_paddle) - (x_target < x_paddle)
+
+
+class BallPredictor:
+
+    def __init__(self, cp, input_queue, max_frames=256):
+        self.__cp = cp
+        self.__input_queue = input_queue
+        self.__max_frames = max_frames
+        self.__expected_balls = deque()
+        self.__ball = cp.ball
+        self.__callbacks = 0
+        self.__mispredictions = 0
+
+    def __call__(self, operation=None, **args):
+        if operation is None:
+            return self.__plan()
+
+        self.__cp(operation)
+        self.__check_ball()
+
+    def draw(self, records):
+        self.__cp.draw(records)
+        self.__check_ball()
+
+    @property
+    def callbacks(self):
+        return self.__callbacks
+
+    @property
+    def mispredictions(self):
+        return self.__mispredictions
+
+    def __check_ball(self):
+        if self.__cp.ball != self.__ball:
+            self.__ball = self.__cp.ball
+            if self.__expected_balls and self.__expected_balls.popleft() != self.__ball:
+                # Ball hit something the model does not know about, drop the queued moves and plan again
+                self.__mispredictions += 1
+                self.__expected_balls.clear()
+                self.__input_queue.clear()
+
+    def __plan(self):
+        self.__callbacks += 1
+        (x_ball, y_ball), (x_paddle, y_paddle) = self.__cp.ball, self.__cp.paddle
+        if self.__cp.last_ball is not None and y_ball == y_paddle - 1 and y_ball > self.__cp.last_ball[1]:
+            # Ball bounces off the paddle in this frame, only keep it under the ball
+            return (x_ball > x_paddle) - (x_ball < x_paddle)
+        path = ball_path(self.__cp, self.__max_frames)
+        if not path:
+            return track_ball_policy(self.__cp)
+
+        x_target = path[-1][0]
+        moves = []
+        for _ in path:
+            move = (x_target > x_paddle) - (x_target < x_paddle)
+            x_paddle += move
+            moves.append(move)
+
+        self.__expected_balls.extend(path)
+        self.__input_queue.extend(moves[1:])
+        return moves[0]
+
+
+class InputRecording:
+
+    def __init__(self, moves=(), snapshots=None, score=None):
+        self.__moves = array('b', moves)
+        self.__snapshots = snapshots if snapshots is not None else {}
+        self.__score = score
+
+    @classmethod
+    def load(cls, file_path):
+        with open(file_path, 'rb') as file:
+            return cls(**pickle.load(file))
+
+    def save(self, file_path):
+        with open(file_path, 'wb') as file:
+            pickle.dump({'moves': self.__moves, 'snapshots': self.__snapshots, 'score': self.__score}, file,
+                        protocol=pickle.HIGHEST_PROTOCOL)
+
+    @property
+    def moves(self):
+        return self.__moves
+
+    @property
+    def score(self):
+        return self.__score
+
+    def wrap(self, input_callback):
+        def record():
+            move = input_callback()
+            self.__moves.append(move)
+            return move
+
+        return record
+
+    def add_snapshot(self, vm, cp):
+        self.__snapshots[len(self.__moves)] = pickle.dumps((vm.snapshot(), cp), protocol=pickle.HIGHEST_PROTOCOL)
+
+    def finish(self, score):
+        self.__score = score
+
+    def replay(self, int_code, frame=None):
+        # Starts from the latest snapshot not after the frame, the remaining moves are consumed straight from the
+        # input queue of the VM without any callback
+        stop = len(self.__moves) if frame is None else min(frame, len(self.__moves))
+        start = max((snapshot_frame for snapshot_frame in self.__snapshots if snapshot_frame <= stop), default=None)
+        input_queue = deque()
+        if start is None:
+            start, cp = 0, HeadlessCarePackager()
+            vm = VirtualMachine(list(int_code), quarters=2, output_callback=cp.draw,
+                                input_callback=self.__out_of_moves, machine_name='Replay', input_queue=input_queue,
+                                output_arity=3)
+        else:
+            snapshot, cp = pickle.loads(self.__snapshots[start])
+            vm = VirtualMachine.from_snapshot(snapshot, output_callback=cp.draw, input_callback=self.__out_of_moves,
+                                              machine_name='Replay', input_queue=input_queue, output_arity=3)
+        input_queue.extend(self.__moves[start:stop])
+
+        if frame is None:
+            vm.run()
+        else:
+            while vm.is_running() and input_queue:
+                vm.step()
+            vm.run_until_input()
+        return vm, cp
+
+    @staticmethod
+    def __out_of_moves():
+        raise Exception('Recording has no more moves')
+
+
+def record_session(int_code, policy=None, snapshot_every=1000):
+    cp = HeadlessCarePackager(policy)
+    recording = InputRecording()
+    vm = VirtualMachine(list(int_code), quarters=2, output_callback=cp.draw, input_callback=recording.wrap(cp),
+                        machine_name='Record', output_arity=3)
+    while vm.is_running():
+        vm.run_until_input()
+        if vm.is_running():
+            if len(recording.moves) % snapshot_every == 0:
+                recording.add_snapshot(vm, cp)
+            vm.step()
+
+    recording.finish(cp.score())
+    return recording
+
+
+def evaluate_branch(branch):
+    snapshot, cp, first_move, policy, horizon = branch
+    moves = []
+
+    def joystick():
+        move = first_move if not moves else policy(cp)
+        moves.append(move)
+        return move
+
+    vm = VirtualMachine.from_snapshot(snapshot, output_callback=cp.draw, input_callback=joystick, output_arity=3)
+    while vm.is_running() and len(moves) < horizon:
+        vm.step()
+        vm.run_until_input()
+
+    is_won = not vm.is_running() and cp.count_printable_blocks() == 0
+    is_alive = vm.is_running() or is_won
+    return (is_won, is_alive, cp.score(), -len(moves)), moves
+
+
+class PaddleStrategySearch:
+    MOVES = (-1, 0, 1)
+
+    def __init__(self, int_code, policies=(track_ball_policy, landing_point_policy), horizon=64, stride=8,
+                 workers=None):
+        self.__int_code = int_code
+        self.__policies = policies
+        self.__horizon = horizon
+        self.__stride = stride
+        self.__workers = workers
+
+    def run(self):
+        cp = HeadlessCarePackager()
+        pending_moves = deque()
+        vm = VirtualMachine(list(self.__int_code), quarters=2, output_callback=cp.draw,
+                            input_callback=pending_moves.popleft, machine_name='Search', output_arity=3)
+
+        moves = []
+        with multiprocessing.Pool(self.__workers) as pool:
+            vm.run_until_input()
+            while vm.is_running():
+                # Every branch starts from the same fork of the game and is played by a worker on its own copy
+                snapshot = vm.snapshot()
+                branches = [(snapshot, cp, move, policy, self.__horizon)
+                            for move in PaddleStrategySearch.MOVES for policy in self.__policies]
+                _, best_moves = max(pool.map(evaluate_branch, branches), key=lambda result: result[0])
+
+                for move in best_moves[:self.__stride]:
+                    pending_moves.append(move)
+                    moves.append(move)
+                    vm.step()
+                    vm.run_until_input()
+                    if not vm.is_running():
+                        break
+
+        return moves, cp.score()
+
+
+def search_main(argv):
+    moves, score = PaddleStrategySearch(parse_file(argv[1])).run()
+    print('Moves: ', len(moves))
+    print('Score: ', score)
+
+
+def predict_main(argv):
+    cp = HeadlessCarePackager()
+    input_queue = deque()
+    predictor = BallPredictor(cp, input_queue)
+    vm = VirtualMachine(parse_file(argv[1]), quarters=2, output_callback=predictor.draw, input_callback=predictor,
+                        machine_name='Robot', input_queue=input_queue, output_arity=3)
+    vm.run()
+
+    print('Printable blocks left: ', cp.count_printable_blocks())
+    print('Score: ', cp.score())
+    print('Input callbacks: ', predictor.callbacks, 'mispredictions: ', predictor.mispredictions)
+
+
+def recording_main(argv):
+    int_code = parse_file(argv[1])
+    if '--record' in argv:
+        recording = record_session(int_code)
+        recording.save(argv[argv.index('--record') + 1])
+        print('Moves: ', len(recording.moves))
+        print('Score: ', recording.score)
+        return
+
+    recording = InputRecording.load(argv[argv.index('--replay') + 1])
+    frame = int(argv[argv.index('--frame') + 1]) if '--frame' in argv else None
+    vm, cp = recording.replay(int_code, frame)
+    print('Printable blocks left: ', cp.count_printable_blocks())
+    print('Score: ', cp.score())
+    if frame is None and cp.score() != recording.score:
+        raise Exception('Replay score {} differs from recorded {}'.format(cp.score(), recording.score))
+
+
+def headless_main(vm, cp):
+    while vm.is_running():
+        vm.run_until_input()
+        if vm.is_running():
+            vm.step()
+
+    print('Printable blocks left: ', cp.count_printable_blocks())
+    print('Score: ', cp.score())
 
 
 def main(argv):
-    cp = CarePackager()
-    vm = VirtualMachine(parse_file(argv[1]), quarters=2, debug=False,
-                        output_callback=cp, input_callback=cp,
-                        machine_name='Robot')
+    if '--search' in argv:
+        return search_main([arg for arg in argv if arg != '--search'])
+    if '--predict' in argv:
+        return predict_main([arg for arg in argv if arg != '--predict'])
+    if '--record' in argv or '--replay' in argv:
+        return recording_main(argv)
+
+    is_headless = '--headless' in argv
+    is_rendering = '--render' in argv
+    argv = [arg for arg in argv if arg not in ('--headless', '--render')]
+
+    cp = HeadlessCarePackager() if is_headless else CarePackager()
+    checkpointer = Checkpointer(argv[2]) if len(argv) > 2 else None
+    if checkpointer is not None and checkpointer.exists():
+        vm, cp = VirtualMachine.resume(checkpointer, debug=False, machine_name='Robot', checkpoint_state=lambda: cp,
+                                       output_arity=3)
+        vm.set_callbacks(cp.draw, cp)
+    else:
+        vm = VirtualMachine(parse_file(argv[1]), quarters=2, debug=False,
+                            output_callback=cp.draw, input_callback=cp, output_arity=3,
+                            machine_name='Robot', checkpointer=checkpointer, checkpoint_state=lambda: cp)
+
+    if is_headless:
+        return headless_main(vm, cp)
+    if is_rendering:
+        return render_main(vm, cp)
 
     print('Loading...')
     is_started_info_printed = True